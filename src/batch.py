@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import collections
+import itertools
+import multiprocessing
+import sys
+import time
+from typing import Callable, Iterable, Iterator, List, TextIO, TypeVar
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+class Progress:
+    """rate limited progress line on stderr, shows rows/sec and an eta if the total is known"""
+
+    def __init__(self: Progress, total: int = None, interval: float = 1.0, stream: TextIO = sys.stderr):
+        self.total = total
+        self.interval = interval
+        self.stream = stream
+        self.done = 0
+        self.start = time.monotonic()
+        self.last = self.start
+
+    def update(self: Progress, n: int = 1) -> None:
+        self.done += n
+        now = time.monotonic()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.__report(now)
+
+    def close(self: Progress) -> None:
+        self.__report(time.monotonic())
+
+    def __report(self: Progress, now: float) -> None:
+        elapsed = now - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        line = f"{self.done} rows, {rate:.1f} rows/s"
+        if self.total is not None:
+            line = f"{self.done}/{self.total} rows, {rate:.1f} rows/s"
+            if rate > 0:
+                line += f", eta {format_duration(max(self.total - self.done, 0) / rate)}"
+        print(line, file = self.stream, flush = True)
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}"
+
+def chunks(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    it = iter(items)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+def _run_chunk(fn: Callable[[T],R], chunk: List[T]) -> List[R]:
+    return [fn(x) for x in chunk]
+
+def ordered_map(fn: Callable[[T],R], items: Iterable[T], jobs: int = 1, chunksize: int = 64, window: int = 4,
+                initializer: Callable = None, initargs: tuple = ()) -> Iterator[R]:
+    """
+    maps fn over items with a pool of jobs processes, results are yielded in input order
+    items are sent to the workers in chunks of chunksize, at most window chunks per worker are in flight
+    so memory stays bounded for arbitrary long inputs
+    initializer is called with initargs once in every worker
+    jobs == 1 runs everything in the current process
+    """
+    if jobs == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        yield from map(fn, items)
+        return
+
+    with multiprocessing.Pool(jobs, initializer, initargs) as pool:
+        pending = collections.deque()
+        for chunk in chunks(items, chunksize):
+            pending.append(pool.apply_async(_run_chunk, (fn, chunk)))
+            if len(pending) >= jobs * window:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
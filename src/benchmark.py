@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+"""
+benchmarks of the segmentation pipeline, on synthetic contracts (see synthetic.py) or on a corpus file
+
+reports contracts/sec, bytes/sec, the time of every phase as collected by Stats and the peak memory of a single
+contract measured with tracemalloc, results can be saved as json and compared against such a baseline
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+import tracemalloc
+import corpus
+import records
+import synthetic
+from etherseg import EtherSeg
+from stats import Stats
+from typing import Dict, List
+
+def load_corpus(path: str, fmt: str = 'csv', limit: int = None) -> List[bytes]:
+    if fmt == corpus.FORMAT:
+        with corpus.Corpus(path) as c:
+            return [bytes(c[i][2]) for i in range(len(c) if limit is None else min(limit, len(c)))]
+    codes = []
+    with open(path, newline = '') as f:
+        for row in records.read_rows(f, fmt):
+            if limit is not None and len(codes) >= limit:
+                break
+            code = row[2][2:] if row[2].startswith('0x') else row[2]
+            codes.append(bytes.fromhex(code))
+    return codes
+
+def segment_all(codes: List[bytes], stats: Stats = None) -> None:
+    # EtherSeg reports failed subprograms on stdout
+    with contextlib.redirect_stdout(io.StringIO()):
+        for code in codes:
+            EtherSeg(code, stats = stats).get_blocks()
+
+def peak_memory(codes: List[bytes]) -> int:
+    """largest peak of traced allocations while segmenting a single contract"""
+    peak = 0
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for code in codes:
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                EtherSeg(code).get_blocks()
+                peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    return peak
+
+def run(codes: List[bytes], repeat: int = 3, memory: bool = True) -> Dict:
+    """best of repeat runs, the phase times are the ones of the best run"""
+    best = None
+    for _ in range(repeat):
+        stats = Stats()
+        start = time.perf_counter()
+        segment_all(codes, stats)
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best[0]:
+            best = (seconds, stats)
+
+    seconds, stats = best
+    size = sum(len(c) for c in codes)
+    result = {
+        'contracts': len(codes),
+        'bytes': size,
+        'seconds': seconds,
+        'contracts_per_s': len(codes) / seconds if seconds > 0 else 0.0,
+        'bytes_per_s': size / seconds if seconds > 0 else 0.0,
+        'phases': dict(stats.times),
+        'counts': dict(stats.counts),
+    }
+    if memory:
+        result['peak_memory'] = peak_memory(codes)
+    return result
+
+def report(result: Dict) -> None:
+    print(f"{result['contracts']} contracts, {result['bytes']} bytes in {result['seconds']:.3f}s")
+    print(f"{result['contracts_per_s']:.1f} contracts/s, {result['bytes_per_s'] / 1024:.1f} KiB/s")
+    total = sum(result['phases'].values())
+    for name, seconds in sorted(result['phases'].items(), key = lambda x: -x[1]):
+        print(f"  {name:20} {seconds:8.3f}s {seconds / total * 100 if total > 0 else 0:5.1f}%")
+    for name, n in sorted(result['counts'].items()):
+        print(f"  {name:20} {n:8}")
+    if 'peak_memory' in result:
+        print(f"peak memory of a single contract {result['peak_memory'] / 2**20:.2f} MiB")
+
+def compare(result: Dict, baseline: Dict, threshold: float) -> bool:
+    """prints the change against the baseline, false if anything got slower or bigger by more than threshold"""
+    ok = True
+    if baseline['contracts'] != result['contracts'] or baseline['bytes'] != result['bytes']:
+        print("warning: the baseline was measured on another corpus")
+
+    rows = [('seconds', result['seconds'], baseline['seconds'])]
+    rows += [('phase ' + k, v, baseline['phases'][k]) for k, v in sorted(result['phases'].items()) if k in baseline['phases']]
+    if 'peak_memory' in result and 'peak_memory' in baseline:
+        rows.append(('peak_memory', result['peak_memory'], baseline['peak_memory']))
+
+    for name, new, old in rows:
+        change = new / old - 1 if old > 0 else 0.0
+        mark = ''
+        # phases that take a tiny share of the time are too noisy to fail on
+        if change > threshold and (not name.startswith('phase') or old >= 0.01 * baseline['seconds']):
+            mark = '  REGRESSION'
+            ok = False
+        print(f"{name:28} {old:12.4g} -> {new:12.4g} {change * 100:+7.1f}%{mark}")
+    return ok
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "benchmarks the segmentation of synthetic contracts or of a corpus file")
+    parser.add_argument('--synthetic', type = int, default = None, help = "number of synthetic contracts")
+    parser.add_argument('--kind', choices = synthetic.KINDS, default = None, help = "only generate contracts of this kind")
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--corpus', default = None, help = "codeid,address,code file")
+    parser.add_argument('--input-format', choices = records.INPUT_FORMATS + (corpus.FORMAT,), default = 'csv')
+    parser.add_argument('--limit', type = int, default = None, help = "use only the first rows of the corpus")
+    parser.add_argument('--repeat', type = int, default = 3, help = "runs of which the fastest is reported")
+    parser.add_argument('--no-memory', action = 'store_true', help = "skip the tracemalloc run")
+    parser.add_argument('--save', default = None, help = "write the result as json baseline")
+    parser.add_argument('--compare', default = None, help = "compare against a json baseline, exits with 1 on regressions")
+    parser.add_argument('--threshold', type = float, default = 0.1, help = "relative slowdown that counts as regression")
+    args = parser.parse_args()
+
+    if (args.synthetic is None) == (args.corpus is None):
+        parser.error("exactly one of --synthetic and --corpus is required")
+    if args.corpus is not None:
+        codes = load_corpus(args.corpus, args.input_format, args.limit)
+    else:
+        codes = synthetic.corpus(args.synthetic, args.seed, args.kind)
+
+    result = run(codes, args.repeat, not args.no_memory)
+    report(result)
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent = 1)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(result, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,11 @@
 from __future__ import annotations
 
 from opcodes import *
+from disassembly import Disassembly
+import array
 import enum
 import GLOBALS
-from typing import List, Dict
+from typing import Iterator, List, Set, Tuple
 
 class BlockType(enum.Enum):
     CODE="code"
@@ -16,36 +18,54 @@ class BlockType(enum.Enum):
     def __repr__(self) -> str:
         return str(self)
 
+class Status(enum.Enum):
+    """how the execution of a block ended"""
+    OK="ok"                     # ran to its end and has successors
+    HALT="halt"                 # ran to its end without successor
+    SKIPPED="skipped"           # did not run, the stack was already seen or the block reached its execution limit
+    UNDERFLOW="underflow"       # an instruction needed more values than the stack had
+    INVALID_JUMP="invalid_jump" # a jump to a position that is no jumpdest
+
+    def failed(self) -> bool:
+        return self in (Status.UNDERFLOW, Status.INVALID_JUMP)
+
+# kinds of the steps a block is compiled to, see Block::compile
+FUSED, PUSH, DUP, SWAP, ADD_, AND_, ISZERO_, JUMP_, JUMPI_, CALL = range(10)
+
+"""1 for opcodes whose handler only pops values and pushes unknown ones"""
+OPAQUE: bytes = bytes(all_opcode_by_value(x).handler in (handleDefault, handleMStore) for x in range(256))
+
 class Block:
 
-    def __setup(self: Block, code:bytes) -> None:
-        skip = 0
+    __slots__ = ('base','btype','known_stack','start','end','needed_stack_size','ops','pcs','disassembly',
+                 'remaining_calls','executed','used_in','prev','next','reachable','likely_code','program','fallthrough')
 
+    def __setup(self: Block) -> None:
         current = 0
 
-        for i in range(self.start,self.end):
-            if skip > 0:
-                skip -= 1
-                continue
-            op = all_opcode_by_value(code[i])
-            skip = op.push_len()
-            self.ins.append((op,i, int.from_bytes(code[i+1:i+skip+1],"big")))
-
+        self.pcs = array.array('I',self.disassembly.walk(self.start,self.end))
+        self.ops = bytes(self.disassembly.code[i] for i in self.pcs)
+        for i in self.ops:
+            op = all_opcode_by_value(i)
             current += op.pop
             self.needed_stack_size = max(self.needed_stack_size,current)
             current -= op.push
             
-    def __is_known(self, stack:[int]) -> bool:
-        return stack[-self.needed_stack_size:] in self.known_stack
+    def stack_key(self, stack:[int]) -> Tuple[int]:
+        """part of the stack that decides if the block was already executed with it"""
+        return tuple(stack[-self.needed_stack_size:])
 
-    def __init__(self, btype:BlockType, start: int, end: int, code:bytes, base: int = 0):
+    def __init__(self, btype:BlockType, start: int, end: int, disassembly: Disassembly, base: int = 0):
         self.base = base
         self.btype = btype
-        self.known_stack: List[List[int]] = []
+        self.known_stack: Set[Tuple[int]] = None    # relevant stack suffixes this block was already executed with, created on first execution
         self.start = start
         self.end = end
         self.needed_stack_size = 0
-        self.ins = []
+        # instructions are stored as opcode bytes and their positions, immediates are read from the code when needed
+        self.ops: bytes = b''
+        self.pcs: array.array = None
+        self.disassembly = disassembly
         self.remaining_calls = GLOBALS.MAX_SINGLE_BLOCK_EXECUTION_SIZE
 
         # executed and used_in are not garantied to be the same
@@ -54,87 +74,223 @@ class Block:
         self.executed = False
         self.used_in = None
 
-        self.__setup(code)
+        # neighbouring blocks and flags derived from them, set by the SubProgram
+        self.prev: Block = None
+        self.next: Block = None
+        self.reachable: bool = None
+        self.likely_code: bool = None
+
+        # steps and successor of the block, compiled on its first execution
+        self.program: List[tuple] = None
+        self.fallthrough: int = None
+
+        self.__setup()
+
+    def instructions(self) -> Iterator[Tuple[OpCode,int,int]]:
+        """yields (opcode, position, immediate) for every instruction of the block"""
+        for k in range(len(self.ops)):
+            yield (all_opcode_by_value(self.ops[k]), self.pcs[k], self.disassembly.immediate(self.pcs[k]))
+
+    def first_op(self) -> OpCode:
+        return all_opcode_by_value(self.ops[0])
+
+    def last_op(self) -> OpCode:
+        return all_opcode_by_value(self.ops[-1])
 
     def min_stack_size(self) -> int:
         min_v:int = 0
         cur:int = 0
-        for i in self.ins:
-            cur -= i[0].pop
+        for i in self.ops:
+            op = all_opcode_by_value(i)
+            cur -= op.pop
             min_v = min(min_v, cur)
-            cur += i[0].push
+            cur += op.push
 
         return min_v * -1 if min_v < 0 else 0
 
-    def execute(self, stack:List[int], jump_dests: List[int]) -> [int]:
+    def compile(self) -> None:
+        """
+        summarises the instructions as steps, a run of opaque opcodes becomes one FUSED step that
+        drops the values the run consumes below its start and pushes the unknown values it leaves
+        the value tracking opcodes get a step of their own, all others call their handler
+        """
+        program = []
+        low = cur = 0   # lowest and current stack height of the open run, relative to its start
+        run = False
+        for k in range(len(self.ops)):
+            op = all_opcode_by_value(self.ops[k])
+            if OPAQUE[op.code]:
+                cur -= op.pop
+                low = min(low, cur)
+                cur += op.push
+                run = True
+                continue
+            if run:
+                program.append((FUSED, -low, cur - low))
+                low = cur = 0
+                run = False
+
+            if op.is_push():
+                program.append((PUSH, self.disassembly.immediate(self.pcs[k])))
+            elif op.is_dup():
+                program.append((DUP, op.pop))
+            elif op.is_swap():
+                program.append((SWAP, op.pop))
+            elif op == ADD:
+                program.append((ADD_,))
+            elif op == AND:
+                program.append((AND_,))
+            elif op == ISZERO:
+                program.append((ISZERO_,))
+            elif op == JUMP:
+                program.append((JUMP_,))
+            elif op == JUMPI:
+                program.append((JUMPI_, self.pcs[k]))
+            else:
+                program.append((CALL, op, self.pcs[k]))
+        if run:
+            program.append((FUSED, -low, cur - low))
+
+        self.program = program
+        if len(self.ops) > 0:
+            self.fallthrough = self.pcs[-1] + 1 + self.last_op().push_len()
+
+    def would_stop(self, key: Tuple[int]) -> bool:
+        """true if executing the block with a stack of this key would return before running it, stays true once it is"""
+        return self.remaining_calls == 0 or (self.known_stack is not None and key in self.known_stack)
+
+    def skip(self) -> None:
+        """has the same effect as an execution that would stop, see would_stop"""
+        self.used_in = self.base
+        if self.remaining_calls != 0:
+            self.remaining_calls-=1
+
+    def execute(self, stack:List[int], jump_dests: JumpDests, key: Tuple[int] = None) -> Tuple[Status,List[int]]:
+        """
+        returns how the execution ended and the successors, key is stack_key(stack), computed here if not given
+        the stack is left in an undefined state if the execution failed
+        """
         self.used_in = self.base
 
         if self.remaining_calls == 0:   # == is on purpose to make it run infinitely when MAX_SINGLE_BLOCK_EXECUTION_SIZE is set to negative
-            return []
+            return Status.SKIPPED, []
         
         self.remaining_calls-=1
 
-        if self.__is_known(stack):
-            return []
-        self.known_stack.append(stack[-self.needed_stack_size:])
-        ret = []
-
-        for i in self.ins:
-            ret = i[0].execute(stack,jump_dests,i[2],i[1])
-            if -1 in ret:
-                raise Exception("invalid jump dest")
+        if self.known_stack is None:
+            self.known_stack = set()
+            self.compile()
+        if key is None:
+            key = self.stack_key(stack)
+        if key in self.known_stack:
+            return Status.SKIPPED, []
+        self.known_stack.add(key)
+
+        status, ret = self.__run(stack, jump_dests)
+        if status.failed():
+            return status, []
         self.executed = True
-        return ret
-
-    def is_reachable(self, all_blocks: Dict[int, Block]) -> bool:
-
-        if hasattr(self,'reachable'):
-            return self.reachable
-        elif self.was_executed():
-            self.reachable = True
-            return True
-        elif self.ins[0][0] == JUMPDEST:
+        return status, ret
+
+    def __run(self, stack:List[int], jump_dests: JumpDests) -> Tuple[Status,List[int]]:
+        """runs the program of the block, returns how it ended and the successors"""
+        # the block continues with the successors of its last instruction
+        ret = None
+        for step in self.program:
+            kind = step[0]
+            ret = None
+            if kind == FUSED:
+                if len(stack) < step[1]:
+                    return Status.UNDERFLOW, None
+                if step[1] > 0:
+                    del stack[-step[1]:]
+                stack.extend([None] * step[2])
+            elif kind == PUSH:
+                stack.append(step[1])
+            elif kind == DUP:
+                if len(stack) < step[1]:
+                    return Status.UNDERFLOW, None
+                stack.append(stack[-step[1]])
+            elif kind == SWAP:
+                if len(stack) < step[1]:
+                    return Status.UNDERFLOW, None
+                stack[-1], stack[-step[1]] = stack[-step[1]], stack[-1]
+            elif kind == CALL:
+                op = step[1]
+                if len(stack) < op.pop:
+                    return Status.UNDERFLOW, None
+                ret = op.handler(op,stack,jump_dests,0,step[2])
+                if -1 in ret:
+                    return Status.INVALID_JUMP, None
+            elif len(stack) < (1 if kind in (ISZERO_, JUMP_) else 2):
+                return Status.UNDERFLOW, None
+            elif kind == ADD_:
+                a = stack.pop()
+                b = stack.pop()
+                stack.append((a + b) % (2**256) if a != None and b != None else None)
+            elif kind == AND_:
+                a = stack.pop()
+                b = stack.pop()
+                stack.append(a & b if a != None and b != None else None)
+            elif kind == ISZERO_:
+                a = stack.pop()
+                stack.append(1 if a == 0 else None if a == None else 0)
+            elif kind == JUMP_:
+                a = stack.pop()
+                dest = jump_dests.kind(a)
+                if dest == JumpDests.INVALID:
+                    return Status.INVALID_JUMP, None
+                ret = [a] if dest == JumpDests.VALID else []
+            else:   # JUMPI_
+                a = stack.pop()
+                b = stack.pop()
+                dest = jump_dests.kind(a)
+                if dest == JumpDests.INVALID and a != None:
+                    return Status.INVALID_JUMP, None
+                ret = []
+                if b == 0 or b == None:
+                    ret.append(step[1] + 1)
+                if dest == JumpDests.VALID and (b != 0 or b == None):
+                    ret.append(a)
+
+        if ret is None:
+            ret = [] if self.fallthrough is None else [self.fallthrough]
+        return Status.OK if len(ret) > 0 else Status.HALT, ret
+
+    def update_reachable(self) -> None:
+        """sets if this block can be reached, the previous block has to be updated before"""
+        pre = self.prev
+
+        if self.was_executed() or self.first_op() == JUMPDEST:
             self.reachable = True
-            return True
-
-        l = [all_blocks[x] for x in all_blocks if x < self.start]
         # true if first block of code
-        if len(l) == 0:
+        elif pre is None:
             self.reachable = True
-            return True
-
-        pre = l[-1]
-
-
-        if pre.btype != BlockType.CODE:
+        elif pre.btype != BlockType.CODE:
             self.reachable = False
-            return False
-        elif pre.ins[-1][0].halts() or pre.ins[-1][0] == JUMP:
+        elif pre.last_op().halts() or pre.last_op() == JUMP:
             self.reachable = False
-            return False
         elif pre.executed:
             self.reachable = True
-            return True
         else:
-            self.reachable = pre.is_reachable(all_blocks)
-            return self.reachable
-
-    def most_likely_code(self, all_blocks: Dict[int, Block]) -> bool:
-        if not self.is_reachable(all_blocks):
-            return False
-
-        if self.ins[-1][0].is_missing():
-            return False
-
-        if self.ins[-1][0].alters_flow() and self.ins[-1][0] != JUMPI:
-            return True
-
-        l = [all_blocks[x] for x in all_blocks if x > self.start]
+            self.reachable = pre.reachable
+
+    def update_likely_code(self) -> None:
+        """sets if this block is most likely code, the next block has to be updated before"""
+        if not self.reachable or self.last_op().is_missing():
+            self.likely_code = False
+        elif self.last_op().alters_flow() and self.last_op() != JUMPI:
+            self.likely_code = True
+        elif self.next is None:
+            self.likely_code = True
+        else:
+            self.likely_code = self.next.likely_code
 
-        if len(l) == 0:
-            return True
+    def is_reachable(self) -> bool:
+        return self.reachable
 
-        return l[0].most_likely_code(all_blocks)
+    def most_likely_code(self) -> bool:
+        return self.likely_code
 
     def was_executed(self) -> bool:
         return self.executed
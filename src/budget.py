@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+import time
+
+class Budget:
+    """
+    limits the work of one EtherSeg analysis, shared by the primary and secondary executions of all its subprograms
+    once it is exhausted the analysis stops and keeps the segmentation found so far
+    """
+
+    def __init__(self: Budget, seconds: float = None, steps: int = None):
+        """
+        Args:
+          seconds (float): wall-clock time the analysis may take from now on, None is unlimited
+          steps (int): number of block executions, None is unlimited
+        """
+        self.deadline = None if seconds is None else time.monotonic() + seconds
+        self.steps = steps
+        self.used = 0
+        self.exhausted = False
+
+    def expired(self: Budget) -> bool:
+        """true if the budget is exhausted, checks the deadline"""
+        if not self.exhausted and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.exhausted = True
+        return self.exhausted
+
+    def take(self: Budget) -> bool:
+        """counts one block execution, false if it must not run anymore"""
+        if self.steps is not None and self.used >= self.steps:
+            self.exhausted = True
+        if self.expired():
+            return False
+        self.used += 1
+        return True
+
+    def charge(self: Budget, steps: int) -> bool:
+        """counts steps block executions at once, false without counting any if they are not all left"""
+        if self.expired() or (self.steps is not None and self.used + steps > self.steps):
+            return False
+        self.used += steps
+        return True
@@ -0,0 +1,101 @@
+"""
+persistent cache for segmentation results, stored in a sqlite file
+
+results are keyed by the sha256 of the bytecode together with a fingerprint of the settings in GLOBALS,
+so changing a setting never returns results computed with another configuration
+"""
+
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import time
+import records
+from block import BlockType
+from budget import Budget
+from etherseg import EtherSeg
+from settings import CACHE_VERSION, settings_fingerprint
+from stats import Stats
+from subcache import SubcodeCache
+from typing import List, Optional, Tuple
+
+"""every how many insertions the size of the cache is checked"""
+EVICTION_CHECK_INTERVAL: int = 256
+
+class ResultCache:
+
+    def __init__(self: ResultCache, path: str, max_size: Optional[int] = None):
+        """
+        Args:
+          path (str): sqlite file, created if it does not exist
+          max_size (int): size of the stored results in bytes, least recently used entries are evicted above it, None is unbounded
+        """
+        self.max_size = max_size
+        self.fingerprint = settings_fingerprint()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__puts = 0
+
+        self.db = sqlite3.connect(path, timeout = 60, isolation_level = None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS results (key BLOB PRIMARY KEY, blocks BLOB NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+
+    def key(self: ResultCache, code: bytes) -> bytes:
+        return hashlib.sha256(self.fingerprint + code).digest()
+
+    def get(self: ResultCache, code: bytes) -> Optional[List[Tuple[int,int,BlockType,int]]]:
+        key = self.key(code)
+        row = self.db.execute("SELECT blocks FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.db.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), key))
+        return records.unpack_blocks(row[0])
+
+    def put(self: ResultCache, code: bytes, blocks: List[Tuple[int,int,BlockType,int]]) -> None:
+        data = records.pack_blocks(blocks)
+        self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", (self.key(code), data, len(data) + 32, time.time()))
+        self.__puts += 1
+        if self.max_size is not None and self.__puts % EVICTION_CHECK_INTERVAL == 0:
+            self.evict()
+
+    def get_blocks(self: ResultCache, code: bytes, budget: Budget = None, stats: Stats = None, subcache: SubcodeCache = None) -> List[Tuple[int,int,BlockType,int]]:
+        """
+        same as EtherSeg(code, budget, stats, subcache).get_blocks(), but answered from the cache when possible, code without any segment returns []
+        results of an analysis that ran out of budget are not stored
+        """
+        blocks = self.get(code)
+        if blocks is None:
+            seg = EtherSeg(code, budget, stats, subcache)
+            blocks = seg.get_blocks()
+            if blocks is None:
+                blocks = []
+            if not seg.truncated:
+                self.put(code, blocks)
+        return blocks
+
+    def size(self: ResultCache) -> int:
+        return int(self.db.execute("SELECT total(size) FROM results").fetchone()[0])
+
+    def evict(self: ResultCache) -> None:
+        """removes least recently used entries until the cache is below 90% of max_size"""
+        size = self.size()
+        if size <= self.max_size:
+            return
+        excess = size - self.max_size * 0.9
+        freed = 0
+        keys = []
+        for key, size in self.db.execute("SELECT key, size FROM results ORDER BY used"):
+            if freed >= excess:
+                break
+            keys.append((key,))
+            freed += size
+        self.db.executemany("DELETE FROM results WHERE key = ?", keys)
+        self.evictions += len(keys)
+
+    def close(self: ResultCache) -> None:
+        self.db.close()
@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+"""
+columnar export of segmentation results as numpy structured arrays, for analytics over whole corpora
+
+a directory holds numbered shards, each of them two .npy files that np.load can memory map:
+  segments-NNNNN.npy  one row per block: contract, start, end, type (TYPE_CODES of records.py), base (NO_BASE if None)
+  contracts-NNNNN.npy one row per result: contract, codeid, length of the code, truncated
+contract is the position of the result in the whole export, so shards can be read on their own
+
+numpy is only needed for this module, install it with pip install numpy
+"""
+
+from __future__ import annotations
+
+import argparse
+import glob
+import os
+import sys
+import records
+from block import BlockType
+from typing import Dict, Iterable, Iterator, List
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+"""output format name of the export in main.py"""
+FORMAT: str = 'npy'
+
+"""blocks per shard, a shard is written once it has at least that many"""
+SHARD_SIZE: int = 1 << 20
+
+SEGMENT_FIELDS = [('contract', '<u4'), ('start', '<u4'), ('end', '<u4'), ('type', 'u1'), ('base', '<u4')]
+
+def contract_fields(width: int) -> List[tuple]:
+    """fields of the contracts table, codeids are stored with the given number of characters"""
+    return [('contract', '<u4'), ('codeid', f'<U{max(width, 1)}'), ('length', '<u4'), ('truncated', '?')]
+
+def require_numpy() -> None:
+    if np is None:
+        raise ImportError("the columnar export needs numpy, install it with pip install numpy")
+
+def shard_path(directory: str, name: str, shard: int) -> str:
+    return os.path.join(directory, f"{name}-{shard:05}.npy")
+
+def save(path: str, array: np.ndarray) -> None:
+    # written under another name first, readers never see a partly written shard
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, array)
+    os.replace(path + '.tmp', path)
+
+def write_columnar(directory: str, results: Iterable[records.Result], shard_size: int = SHARD_SIZE) -> Iterator[records.Result]:
+    """writes the results to directory as they pass through, like the writers in records.py"""
+    require_numpy()
+    os.makedirs(directory, exist_ok = True)
+    segments = []
+    contracts = []
+    shard = 0
+    for contract, r in enumerate(results):
+        contracts.append((contract, r[0], r[1], r[3]))
+        segments.extend((contract, b[0], b[1], records.TYPE_CODES[b[2]], records.NO_BASE if b[3] is None else b[3]) for b in r[2])
+        if len(segments) >= shard_size:
+            write_shard(directory, shard, segments, contracts)
+            shard += 1
+            segments = []
+            contracts = []
+        yield r
+    if len(contracts) > 0:
+        write_shard(directory, shard, segments, contracts)
+
+def write_shard(directory: str, shard: int, segments: List[tuple], contracts: List[tuple]) -> None:
+    width = max(len(c[1]) for c in contracts)
+    save(shard_path(directory, 'segments', shard), np.array(segments, dtype = SEGMENT_FIELDS))
+    save(shard_path(directory, 'contracts', shard), np.array(contracts, dtype = contract_fields(width)))
+
+class ColumnarExport:
+    """read side of an export directory, all arrays are memory mapped, nothing is turned into python objects"""
+
+    def __init__(self: ColumnarExport, directory: str):
+        require_numpy()
+        self.segment_paths = sorted(glob.glob(os.path.join(directory, 'segments-*.npy')))
+        self.contract_paths = sorted(glob.glob(os.path.join(directory, 'contracts-*.npy')))
+
+    def segment_shards(self: ColumnarExport, types: Iterable[BlockType] = None) -> Iterator[np.ndarray]:
+        """segments of every shard, only the ones of the given types if set"""
+        codes = None if types is None else np.array([records.TYPE_CODES[t] for t in types], dtype = 'u1')
+        for path in self.segment_paths:
+            shard = np.load(path, mmap_mode = 'r')
+            yield shard if codes is None else shard[np.isin(shard['type'], codes)]
+
+    def segments(self: ColumnarExport, types: Iterable[BlockType] = None) -> np.ndarray:
+        """segments of all shards in one array, only the selected ones are copied out of the maps"""
+        shards = list(self.segment_shards(types))
+        if len(shards) == 0:
+            return np.zeros(0, dtype = SEGMENT_FIELDS)
+        return shards[0] if len(shards) == 1 else np.concatenate(shards)
+
+    def contracts(self: ColumnarExport) -> np.ndarray:
+        """contracts of all shards in one array, their codeids are widened to the longest one"""
+        shards = [np.load(path, mmap_mode = 'r') for path in self.contract_paths]
+        if len(shards) == 0:
+            return np.zeros(0, dtype = contract_fields(1))
+        if len(shards) == 1:
+            return shards[0]
+        dtype = contract_fields(max(s.dtype['codeid'].itemsize // 4 for s in shards))
+        return np.concatenate([s.astype(dtype) for s in shards])
+
+    def summary(self: ColumnarExport) -> Dict[str,Dict[str,int]]:
+        """number of blocks and covered bytes per type, computed shard by shard"""
+        ret = {t.value: {'blocks': 0, 'bytes': 0} for t in records.TYPE_CODES}
+        for shard in self.segment_shards():
+            size = shard['end'].astype('i8') - shard['start'] + 1
+            blocks = np.bincount(shard['type'], minlength = len(records.TYPE_CODES))
+            covered = np.bincount(shard['type'], weights = size, minlength = len(records.TYPE_CODES))
+            for t, code in records.TYPE_CODES.items():
+                ret[t.value]['blocks'] += int(blocks[code])
+                ret[t.value]['bytes'] += int(covered[code])
+        return ret
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "converts binary results of main.py into a columnar export, or summarizes an export")
+    parser.add_argument('input', help = "binary results (--output-format binary) or an export directory with --summary")
+    parser.add_argument('output', nargs = '?', help = "export directory")
+    parser.add_argument('--shard-size', type = int, default = SHARD_SIZE, help = "blocks per shard")
+    parser.add_argument('--summary', action = 'store_true', help = "print blocks and bytes per type of the export in input")
+    args = parser.parse_args()
+
+    if args.summary:
+        for t, v in ColumnarExport(args.input).summary().items():
+            print(f"{t}: {v['blocks']} blocks, {v['bytes']} bytes")
+        return
+    if args.output is None:
+        parser.error("the export directory is missing")
+    with open(args.input, 'rb') as f:
+        n = sum(1 for _ in write_columnar(args.output, records.read_binary(f), args.shard_size))
+    print(f"{n} results written to {args.output}", file = sys.stderr)
+
+if __name__ == '__main__':
+    main()
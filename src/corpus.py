@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+"""
+binary corpus format, read through mmap so workers get any contract without decoding or copying it
+
+layout, all little endian:
+  header: magic (8 bytes), number of entries (u64), offset of the index (u64)
+  entries: codeid length (u16), codeid (utf-8), address length (u16), address (utf-8), code length (u32), code
+  index: offset of every entry (u64)
+
+the code of an entry is handed out as memoryview of the map, EtherSeg works on it directly
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import mmap
+import os
+import struct
+import sys
+import records
+from typing import BinaryIO, Iterable, Iterator, Tuple
+
+MAGIC = b'ESCORP01'
+HEADER = struct.Struct('<8sQQ')
+NAME = struct.Struct('<H')
+LENGTH = struct.Struct('<I')
+OFFSET = struct.Struct('<Q')
+
+"""input format name of the binary corpus in main.py and benchmark.py"""
+FORMAT: str = 'corpus'
+
+Entry = Tuple[str, str, memoryview]
+
+class Corpus:
+    """
+    read only view of a binary corpus file, entries are (codeid, address, code)
+    the memoryviews of the code have to be released before the corpus is closed
+    """
+
+    def __init__(self: Corpus, path: str):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        self.data = memoryview(self.map)
+        magic, count, index = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a binary corpus")
+        self.index = index
+        self.count = count
+
+    def __len__(self: Corpus) -> int:
+        return self.count
+
+    def __getitem__(self: Corpus, i: int) -> Entry:
+        if not 0 <= i < self.count:
+            raise IndexError(f"entry {i} of {self.count}")
+        pos = OFFSET.unpack_from(self.data, self.index + i * OFFSET.size)[0]
+        codeid, pos = self.__name(pos)
+        address, pos = self.__name(pos)
+        length = LENGTH.unpack_from(self.data, pos)[0]
+        pos += LENGTH.size
+        return codeid, address, self.data[pos:pos + length]
+
+    def __iter__(self: Corpus) -> Iterator[Entry]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def __name(self: Corpus, pos: int) -> Tuple[str,int]:
+        length = NAME.unpack_from(self.data, pos)[0]
+        pos += NAME.size
+        return str(self.data[pos:pos + length], 'utf-8'), pos + length
+
+    def close(self: Corpus) -> None:
+        self.data.release()
+        self.map.close()
+
+    def __enter__(self: Corpus) -> Corpus:
+        return self
+
+    def __exit__(self: Corpus, *exc) -> None:
+        self.close()
+
+def write_entry(fp: BinaryIO, codeid: str, address: str, code: bytes) -> None:
+    for name in (codeid, address):
+        name = (name or '').encode('utf-8')
+        fp.write(NAME.pack(len(name)) + name)
+    fp.write(LENGTH.pack(len(code)))
+    fp.write(code)
+
+def write_corpus(path: str, rows: Iterable[records.Row]) -> int:
+    """writes the rows with hex encoded code as binary corpus, returns the number of entries"""
+    count = 0
+    tmp = path + '.tmp'
+    offsets = io.BytesIO()
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, 0, 0))
+        for codeid, address, code in rows:
+            offsets.write(OFFSET.pack(f.tell()))
+            count += 1
+            write_entry(f, codeid, address, bytes.fromhex(code[2:] if code[0:2] == '0x' else code))
+        index = f.tell()
+        f.write(offsets.getbuffer())
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, count, index))
+    # readers never see a partly written corpus
+    os.replace(tmp, path)
+    return count
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "converts codeid,address,code rows into a binary corpus")
+    parser.add_argument('input', help = "csv or jsonl file")
+    parser.add_argument('output', help = "binary corpus file")
+    parser.add_argument('--input-format', choices = records.INPUT_FORMATS, default = 'csv')
+    args = parser.parse_args()
+
+    with open(args.input, newline = '') as f:
+        n = write_corpus(args.output, records.read_rows(f, args.input_format))
+    print(f"{n} entries written to {args.output}", file = sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import array
+import bisect
+from opcodes import JUMPDEST, PUSH1, PUSH32, all_opcode_by_value
+from typing import Sequence
+
+"""length of the instruction starting with the given byte, including its immediate"""
+INSTRUCTION_LENGTH: bytes = bytes(x - PUSH1.code + 2 if PUSH1.code <= x <= PUSH32.code else 1 for x in range(256))
+"""OpCode::is_invalid and OpCode::alters_flow for every byte"""
+IS_INVALID: bytes = bytes(all_opcode_by_value(x).is_invalid() for x in range(256))
+ALTERS_FLOW: bytes = bytes(all_opcode_by_value(x).alters_flow() for x in range(256))
+
+class Disassembly:
+    """
+    instruction boundaries of a code, decoded once from position 0 and shared by the jumpdest search,
+    the block creation and the blocks themselves
+
+    window(offset) returns a Disassembly of code[offset:] as if decoding started at offset,
+    it shares all tables and the code with this one, its positions are relative to offset
+    """
+
+    def __init__(self: Disassembly, code: bytes, offset: int = 0, shared: Disassembly = None):
+        if shared is None:
+            n = len(code)
+            self.buffer = code
+            self.starts = bytearray(n)                  # 1 where an instruction starts
+            self.positions = array.array('I')           # all instruction starts in order
+            self.dests = bytearray(n)                   # 1 where a JUMPDEST instruction starts
+            i = 0
+            while i < n:
+                self.starts[i] = 1
+                self.positions.append(i)
+                i += INSTRUCTION_LENGTH[code[i]]
+            for i in self.positions:
+                if code[i] == JUMPDEST.code:
+                    self.dests[i] = 1
+        else:
+            self.buffer = shared.buffer
+            self.starts = shared.starts
+            self.positions = shared.positions
+            self.dests = shared.dests
+
+        self.offset = offset
+        self.code = self.buffer if offset == 0 else memoryview(self.buffer)[offset:]
+
+        # decoding from offset follows its own boundaries until it reaches an instruction start of the shared pass
+        self.head_dests = set()
+        i = offset
+        while i < len(self.buffer) and not self.starts[i]:
+            if self.buffer[i] == JUMPDEST.code:
+                self.head_dests.add(i - offset)
+            i += INSTRUCTION_LENGTH[self.buffer[i]]
+        self.aligned = i
+
+    def window(self: Disassembly, offset: int) -> Disassembly:
+        return Disassembly(self.buffer, offset, self)
+
+    def walk(self: Disassembly, start: int, end: int) -> Sequence[int]:
+        """
+        returns the instruction starts in [start, end) when decoding begins at start
+        decoding from a position that is no instruction start of the shared pass realigns with it after a few instructions,
+        only those are decoded again
+        """
+        start += self.offset
+        end += self.offset
+        head = []
+        i = start
+        while i < end and not self.starts[i]:
+            head.append(i)
+            i += INSTRUCTION_LENGTH[self.buffer[i]]
+        lo = bisect.bisect_left(self.positions, i)
+        hi = bisect.bisect_left(self.positions, end, lo)
+        if self.offset != 0:
+            return [x - self.offset for x in head] + [x - self.offset for x in self.positions[lo:hi]]
+        if len(head) > 0:
+            return head + self.positions[lo:hi].tolist()
+        return self.positions[lo:hi]
+
+    def is_jumpdest(self: Disassembly, pos: int) -> bool:
+        """true if a JUMPDEST starts at pos when decoding from the beginning of this disassembly"""
+        pos += self.offset
+        if pos < self.aligned:
+            return pos - self.offset in self.head_dests
+        return pos < len(self.buffer) and self.dests[pos] == 1
+
+    def immediate(self: Disassembly, pos: int) -> int:
+        """value pushed by the instruction at pos, 0 for everything but PUSH"""
+        return int.from_bytes(self.code[pos + 1:pos + INSTRUCTION_LENGTH[self.code[pos]]], "big")
@@ -1,23 +1,62 @@
 from __future__ import annotations
 
+import enum
 from block import BlockType, Block
 from opcodes import *
 import structure
+from disassembly import Disassembly
+from budget import Budget
+from intervals import IntervalIndex, IntervalSet
+from stats import Stats, phase
+from subcache import SubcodeCache, CachedSubProgram
 from subprogram import *
-from typing import List,Tuple
+from typing import Iterator,List,Tuple
+
+def pretty_lines(blocks: List[Tuple[int,int,BlockType,int]], length: int) -> Iterator[str]:
+    if len(blocks) == 0:
+        yield f"{hex(0)},{hex(length)},{BlockType.DATA},{None}"
+        return
+    for i in blocks:
+        yield f"{hex(i[0])},{hex(i[1])},{i[2]},{hex(i[3]) if i[3] != None else None}"
+
+class Tier(enum.IntEnum):
+    """how much of the analysis an EtherSeg has done, every tier includes the ones before it"""
+    STRUCTURE = 0   # metadata and code starts from structure.decompose
+    MAIN = 1        # symbolic execution of the first subprogram
+    FULL = 2        # symbolic execution of all subprograms
 
 class EtherSeg:
 
-    def get_blocks(self: EtherSeg) -> List[Tuple[int,int,BlockType,int]]:
+    def get_structure(self: EtherSeg) -> List[Tuple[int,int,BlockType]]:
+        """code starts and metadata found by structure.decompose, without any symbolic execution"""
+        self.analyse(Tier.STRUCTURE)
+        return self.structure
+
+    def get_blocks(self: EtherSeg, tier: Tier = Tier.FULL) -> List[Tuple[int,int,BlockType,int]]:
+        """
+        segmentation with the subprograms of the given tier, MAIN only contains the first one
+        computed on first use and memoized, the returned list must not be modified
+        """
+        if tier < Tier.MAIN:
+            raise ValueError("blocks need at least Tier.MAIN, use get_structure for Tier.STRUCTURE")
+        if tier not in self.__blocks:
+            self.analyse(tier)
+            sub_programs = self.sub_programs[:self.main_programs] if tier == Tier.MAIN else self.sub_programs
+            with phase(self.stats, 'get_blocks'):
+                self.__blocks[tier] = self.__collect_blocks(sub_programs)
+        return self.__blocks[tier]
+
+    def __collect_blocks(self: EtherSeg, sub_programs: List[SubProgram]) -> List[Tuple[int,int,BlockType,int]]:
         ret = 0
         blocks = []
 
-        if len(self.sub_programs) == 0:
+        if len(sub_programs) == 0:
             return
 
-        for i in self.sub_programs:
+        for i in sub_programs:
 
-            code_blocks = [i.blocks[x] for x in i.blocks if i.blocks[x].btype == BlockType.CODE and i.blocks[x].used_in != None]
+            # (true start, true end) of the used code blocks, all of them have the same type
+            code_blocks = [(x[0] + i.base, x[1] + i.base) for x in i.code_blocks() if x[2]]
             if len(code_blocks) == 0:
                 return []
 
@@ -28,16 +67,13 @@ class EtherSeg:
 
                 if current == j:
                     continue
-                elif current.true_end() == j.true_start() and current.btype == j.btype:
+                elif current[1] == j[0]:
                     current = j
-                elif current.true_end() < j.true_start():
-                    blocks.append((start.true_start(),current.true_end(),start.btype,i.base))
-                    blocks.append((current.true_end(),j.true_start(),BlockType.DATA,None))
+                elif current[1] < j[0]:
+                    blocks.append((start[0],current[1],BlockType.CODE,i.base))
+                    blocks.append((current[1],j[0],BlockType.DATA,None))
                     start = current = j
-                elif current.true_end() == j.true_start() and current.btype != j.btype:
-                    blocks.append((start.true_start(),current.true_end(),start.btype,i.base))
-                    start = current = j
-            blocks.append((start.true_start(),code_blocks[-1].true_end(),start.btype,i.base))
+            blocks.append((start[0],code_blocks[-1][1],BlockType.CODE,i.base))
 
         for i in self.meta:
             blocks.append((i[0],i[1],BlockType.META,None))
@@ -60,12 +96,8 @@ class EtherSeg:
         return ret_blocks
 
     def pretty_print(self: EtherSeg) -> None:
-        b = self.get_blocks()
-        if len(b) == 0:
-            print(f"{hex(0)},{hex(len(self.code))},{BlockType.DATA},{None}")
-            return
-        for i in b:
-            print(f"{hex(i[0])},{hex(i[1])},{i[2]},{hex(i[3]) if i[3] != None else None}")
+        for line in pretty_lines(self.get_blocks(), len(self.code)):
+            print(line)
   
     def legacy_print(self: Program) -> None:
         b = self.get_blocks()
@@ -75,36 +107,108 @@ class EtherSeg:
         for i in b:
             print(f"{hex(i[0])},{hex(i[1])},{i[2]}")
 
+    def blocks_at(self: EtherSeg, pc: int, tier: Tier = Tier.FULL) -> List[Tuple[int,int,BlockType,int]]:
+        """blocks of get_blocks(tier) that contain pc, usually one, ordered by start"""
+        return self.__index(tier).at(pc)
+
+    def blocks_in(self: EtherSeg, start: int, end: int, tier: Tier = Tier.FULL) -> List[Tuple[int,int,BlockType,int]]:
+        """blocks of get_blocks(tier) that share a position with start..end, end is inclusive like in get_blocks"""
+        return self.__index(tier).overlapping(start, end + 1)
+
+    def __index(self: EtherSeg, tier: Tier) -> IntervalIndex:
+        if tier not in self.__indexes:
+            blocks = self.get_blocks(tier)
+            self.__indexes[tier] = IntervalIndex((b[0], b[1] + 1, b) for b in blocks or [])
+        return self.__indexes[tier]
+
     def __in_block(self: EtherSeg, block_start: (int,int,BlockType)) -> bool:
-        for s in self.sub_programs:
-            for b in [x for x in s.blocks if s.blocks[x].btype == BlockType.CODE]:
-                if s.blocks[b].true_start() <= block_start[0] < s.blocks[b].true_end():
-                    return True
-        return False
+        # code blocks of subprograms added since the last check are merged into the covered positions first
+        for s in self.sub_programs[self.__covered:]:
+            self.__code.update((b[0] + s.base, b[1] + s.base) for b in s.code_blocks())
+        self.__covered = len(self.sub_programs)
+        return block_start[0] in self.__code
             
-    def __init__(self: EtherSeg, code: bytes):
+    def __init__(self: EtherSeg, code: bytes, budget: Budget = None, stats: Stats = None, subcache: SubcodeCache = None, lazy: bool = False):
+        """
+        budget limits the analysis, truncated is set if it ran out and only the segmentation found so far is returned
+        stats collects phase times and counters of this analysis and of get_blocks if given, it may be shared by many analyses
+        subcache answers subprograms that were already analysed as part of another code, see subcache.py
+        lazy defers the analysis to the first query that needs it, otherwise all tiers are computed right away
+        """
         self.code = code
         self.sub_programs = []
-        self.structure = structure.decompose(code)
-
-        code_blocks = [x for x in self.structure if x[2] == BlockType.CODE]
-        self.meta = [x for x in self.structure if x[2] == BlockType.META]
-        if len(code_blocks) == 0:
-            return
-
+        self.budget = budget if budget is not None else Budget()
+        self.stats = stats
+        self.subcache = subcache
+        self.truncated = False
+        self.tier = None        # highest tier computed so far
+        self.main_programs = 0  # number of sub_programs that belong to Tier.MAIN
+        self.__blocks = {}      # tier -> result of get_blocks
+        self.__indexes = {}     # tier -> IntervalIndex over get_blocks
+        self.__code = IntervalSet()     # positions in a code block of one of the first __covered sub_programs
+        self.__covered = 0
+        if not lazy:
+            self.analyse(Tier.FULL)
+
+    def analyse(self: EtherSeg, tier: Tier) -> None:
+        """computes all tiers up to the given one that are not computed yet"""
+        if self.tier is None:
+            with phase(self.stats, 'decompose'):
+                self.structure = structure.decompose(self.code)
+            self.code_starts = [x for x in self.structure if x[2] == BlockType.CODE]
+            self.meta = [x for x in self.structure if x[2] == BlockType.META]
+            self.tier = Tier.STRUCTURE
+
+        if tier >= Tier.MAIN and self.tier < Tier.MAIN:
+            # decoded once, every subprogram works on a window of it instead of a copy of its code
+            with phase(self.stats, 'disassembly'):
+                self.disassembly = Disassembly(self.code)
+            if len(self.code_starts) > 0:
+                self.__add_sub_program(self.disassembly,self.code_starts[0])
+            self.main_programs = len(self.sub_programs)
+            self.tier = Tier.MAIN
+
+        if tier >= Tier.FULL and self.tier < Tier.FULL:
+            for i in self.code_starts[1:]:
+                if self.__in_block(i):
+                    if self.stats is not None:
+                        self.stats.count('subprograms_skipped')
+                    continue
+                if self.budget.expired():
+                    break
+
+                self.__add_sub_program(self.disassembly.window(i[0]),i)
+            self.tier = Tier.FULL
+        self.truncated = self.budget.exhausted
+
+    def __add_sub_program(self: EtherSeg, disassembly: Disassembly, size: Tuple[int,int,BlockType]) -> None:
+        """adds the subprogram starting at size[0], from the subcache if possible"""
+        if self.stats is not None:
+            self.stats.count('subprograms')
+        key = None
+        if self.subcache is not None:
+            key = self.subcache.key(disassembly.code, size, self.meta)
+            entry = self.subcache.get(key)
+            # without the steps it took left the subprogram is analysed again, so it is cut where it would be without cache
+            if entry is not None and self.budget.charge(entry[1]):
+                self.sub_programs.append(CachedSubProgram(size[0], entry[0]))
+                if self.stats is not None:
+                    self.stats.count('subcode_cache_hits')
+                return
+
+        used = self.budget.used
         try:
-            self.sub_programs.append(SubProgram(code,code_blocks[0],self.meta))
+            self.sub_programs.append(SubProgram(disassembly,size,self.meta,self.budget,self.stats))
             self.sub_programs[-1].execute()
         except Exception as e:
-            print(e)
-        for i in code_blocks[1:]:
-            if self.__in_block(i):
-                continue
-
-            try:
-                self.sub_programs.append(SubProgram(code[i[0]:],i,self.meta))
-                self.sub_programs[-1].execute()
-            except Exception as e:
-                print(e)
-                continue
+            self.__failed(e)
+            return
+        # a subprogram cut short by the budget depends on what ran before it
+        if key is not None and not self.budget.exhausted:
+            self.subcache.put(key, self.sub_programs[-1].code_blocks(), self.budget.used - used)
+
+    def __failed(self: EtherSeg, e: Exception) -> None:
+        print(e)
+        if self.stats is not None:
+            self.stats.count('exceptions')
             
@@ -0,0 +1,65 @@
+"""
+sorted interval structures for offset queries, all intervals are half open [start, end)
+"""
+
+from __future__ import annotations
+
+import bisect
+import itertools
+from typing import Any, Iterable, List, Tuple
+
+class IntervalSet:
+    """union of intervals, merged into sorted disjoint ones so a lookup is a single bisect"""
+
+    def __init__(self: IntervalSet):
+        self.starts = []
+        self.ends = []
+
+    def update(self: IntervalSet, intervals: Iterable[Tuple[int,int]]) -> None:
+        """adds all intervals at once, the set is rebuilt once instead of per interval"""
+        starts = []
+        ends = []
+        for start, end in sorted(itertools.chain(zip(self.starts, self.ends), intervals)):
+            if start >= end:
+                continue
+            if len(ends) > 0 and start <= ends[-1]:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        self.starts = starts
+        self.ends = ends
+
+    def __contains__(self: IntervalSet, pos: int) -> bool:
+        i = bisect.bisect_right(self.starts, pos) - 1
+        return i >= 0 and pos < self.ends[i]
+
+    def __len__(self: IntervalSet) -> int:
+        return len(self.starts)
+
+class IntervalIndex:
+    """
+    static index over intervals that may overlap, given as (start, end, value), empty ones are left out
+    sorted by start with the largest end seen so far, a query bisects both and only visits intervals that start
+    before the query ends and behind the first one reaching into it, O(log n) plus the size of the answer if they hardly overlap
+    """
+
+    def __init__(self: IntervalIndex, intervals: Iterable[Tuple[int,int,Any]]):
+        self.items = sorted((x for x in intervals if x[0] < x[1]), key = lambda x: (x[0], x[1]))
+        self.starts = [x[0] for x in self.items]
+        self.reach = list(itertools.accumulate((x[1] for x in self.items), max))
+
+    def overlapping(self: IntervalIndex, start: int, end: int) -> List[Any]:
+        """values of all intervals that share a position with [start, end), ordered by their start"""
+        if start >= end:
+            return []
+        hi = bisect.bisect_left(self.starts, end)
+        lo = bisect.bisect_right(self.reach, start, 0, hi)
+        return [x[2] for x in self.items[lo:hi] if x[1] > start]
+
+    def at(self: IntervalIndex, pos: int) -> List[Any]:
+        """values of all intervals containing pos, ordered by their start"""
+        return self.overlapping(pos, pos + 1)
+
+    def __len__(self: IntervalIndex) -> int:
+        return len(self.items)
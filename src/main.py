@@ -1,7 +1,21 @@
 #!/usr/bin/python3
 
+import argparse
+import collections
+import contextlib
+import os
 import sys
 from etherseg import *
+import batch
+from budget import Budget
+from cache import ResultCache
+import columnar
+import corpus
+from corpus import Corpus
+from stats import Stats
+from subcache import SubcodeCache
+import records
+from typing import Dict, Iterable, Iterator, List, Tuple
 
 def drop0x(hex: str) -> str:
     return (None if hex is None else
@@ -9,18 +23,168 @@ def drop0x(hex: str) -> str:
             hex
            )
 
-def main() -> None:
-    for idx, line in enumerate(sys.stdin):
-        print(f"{idx}",file = sys.stderr)
-        row = line.rstrip('\n').split(',')
-        codeid = row[0]
-        if codeid == 'codeid':
-            continue
-        address = row[1]
+# binary corpus, result cache, subcode cache, per contract limits and stats switch of the current worker, set by init_worker
+entries: Corpus = None
+cache: ResultCache = None
+subcache: SubcodeCache = None
+deadline: float = None
+max_steps: int = None
+collect_stats: bool = False
+
+def init_worker(cache_path: str, cache_size: int, seconds: float = None, steps: int = None, with_stats: bool = False, subcode_entries: int = 0,
+                corpus_path: str = None) -> None:
+    global entries, cache, subcache, deadline, max_steps, collect_stats
+    if corpus_path is not None:
+        entries = Corpus(corpus_path)
+    if cache_path is not None:
+        cache = ResultCache(cache_path, cache_size)
+    if subcode_entries > 0:
+        subcache = SubcodeCache(subcode_entries)
+    deadline = seconds
+    max_steps = steps
+    collect_stats = with_stats
+
+def segment(row: records.Row) -> Tuple[records.Result, Dict[str,int]]:
+    """returns the result for the row and the counters it changed"""
+    try:
         code = bytes.fromhex(drop0x(row[2]))
-        prog = EtherSeg(code)
+        blocks, truncated, counts = analyse(code)
+    except Exception as e:
+        return failed(row[0], e)
+    return (row[0], len(code), blocks, truncated), counts
+
+def segment_entry(i: int) -> Tuple[records.Result, Dict[str,int]]:
+    """same as segment for entry i of the binary corpus, its code is analysed in place"""
+    codeid, _, code = entries[i]
+    try:
+        blocks, truncated, counts = analyse(code)
+    except Exception as e:
+        return failed(codeid, e)
+    return (codeid, len(code), blocks, truncated), counts
+
+def failed(codeid: str, error: Exception) -> Tuple[records.Result, Dict[str,int]]:
+    """result without blocks for a row that could not be segmented, so one bad row does not end the whole run"""
+    print(f"{codeid} failed: {error!r}", file = sys.stderr)
+    return (codeid, 0, [], False), {'errors': 1}
+
+def analyse(code: bytes) -> Tuple[List[Tuple[int,int,BlockType,int]], bool, Dict[str,int]]:
+    """segments the code with the settings of the current worker, returns the blocks, whether they are truncated and the counters it changed"""
+    counts = {}
+    budget = Budget(deadline, max_steps)
+    stats = Stats() if collect_stats else None
+
+    # EtherSeg reports failed subprograms on stdout, that must not end up in the results
+    with contextlib.redirect_stdout(sys.stderr):
+        if cache is not None:
+            hits = cache.hits
+            blocks = cache.get_blocks(code, budget, stats, subcache)
+            counts['cache_hits' if cache.hits > hits else 'cache_misses'] = 1
+        else:
+            blocks = EtherSeg(code, budget, stats, subcache).get_blocks()
+    if budget.exhausted:
+        counts['truncated'] = 1
+    if stats is not None:
+        counts.update(stats.as_dict())
+    return blocks if blocks is not None else [], budget.exhausted, counts
+
+def tally(outputs: Iterable[Tuple[records.Result, Dict[str,int]]], totals: collections.Counter) -> Iterator[records.Result]:
+    for result, counts in outputs:
+        totals.update(counts)
+        yield result
+
+def count_rows(path: str, fmt: str) -> int:
+    """rows of a csv or jsonl file for the progress estimate, counted as lines without parsing them"""
+    lines = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        # read_csv skips the header, so it is no row
+        header = fmt == 'csv' and f.read(6) == b'codeid'
+        f.seek(0)
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            lines += chunk.count(b'\n')
+            last = chunk[-1:]
+    # the last line may end without newline
+    if last != b'\n':
+        lines += 1
+    return lines - header
+
+def add_worker_arguments(parser: argparse.ArgumentParser) -> None:
+    """options of the analysis in the workers, see worker_args"""
+    parser.add_argument('--cache', default = None, help = "sqlite file used as persistent result cache")
+    parser.add_argument('--cache-size', type = int, default = None, help = "maximum size of the cache in MB")
+    parser.add_argument('--subcode-cache', type = int, default = 4096, help = "subprogram results every worker keeps in memory, 0 disables it")
+    parser.add_argument('--deadline', type = float, default = None, help = "seconds a single contract may take, its result is truncated afterwards")
+    parser.add_argument('--max-steps', type = int, default = None, help = "block executions a single contract may take, its result is truncated afterwards")
+    parser.add_argument('--stats', action = 'store_true', help = "report time per phase and counters summed over all rows, on stderr or in /stats of the server")
+
+def worker_args(args: argparse.Namespace) -> tuple:
+    """arguments of init_worker for the options of add_worker_arguments"""
+    cache_size = args.cache_size * 2**20 if args.cache_size is not None else None
+    return (args.cache, cache_size, args.deadline, args.max_steps, args.stats, args.subcode_cache)
+
+def report(args: argparse.Namespace, totals: collections.Counter) -> None:
+    """prints the counters of a run to stderr"""
+    if args.cache is not None:
+        print(f"cache: {totals['cache_hits']} hits, {totals['cache_misses']} misses", file = sys.stderr)
+    if totals['truncated'] > 0:
+        print(f"{totals['truncated']} rows ran out of budget and are truncated", file = sys.stderr)
+    if totals['errors'] > 0:
+        print(f"{totals['errors']} rows failed and have no blocks", file = sys.stderr)
+    if args.stats:
+        for line in Stats.from_dict(totals).lines():
+            print(line, file = sys.stderr)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "segments codeid,address,code csv rows")
+    parser.add_argument('input', nargs = '?', help = "input file, defaults to stdin")
+    parser.add_argument('-j', '--jobs', type = int, default = 1, help = "number of worker processes, 0 uses all cores")
+    parser.add_argument('--chunksize', type = int, default = 64, help = "rows sent to a worker at once")
+    parser.add_argument('--total', type = int, default = None, help = "number of rows, used for the eta")
+    parser.add_argument('--progress-interval', type = float, default = 1.0, help = "seconds between progress lines")
+    parser.add_argument('--input-format', choices = records.INPUT_FORMATS + (corpus.FORMAT,), default = 'csv')
+    parser.add_argument('--output-format', choices = records.OUTPUT_FORMATS + (columnar.FORMAT,), default = 'text')
+    parser.add_argument('--output-dir', default = None, help = "directory of the npy export, see columnar.py")
+    add_worker_arguments(parser)
+    args = parser.parse_args()
+    if (args.output_format == columnar.FORMAT) != (args.output_dir is not None):
+        parser.error("--output-dir is required by and only used for --output-format npy")
+    if args.output_format == columnar.FORMAT and columnar.np is None:
+        parser.error("--output-format npy needs numpy, install it with pip install numpy")
+
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+    total = args.total
+    initargs = worker_args(args)
+    if args.input_format == corpus.FORMAT:
+        if args.input is None:
+            parser.error("a binary corpus cannot be read from stdin")
+        # workers map the corpus themselves, only the entry numbers are sent to them
+        with Corpus(args.input) as c:
+            total = len(c)
+        src = contextlib.nullcontext()
+        initargs += (args.input,)
+    else:
+        if total is None and args.input is not None:
+            total = count_rows(args.input, args.input_format)
+        src = sys.stdin if args.input is None else open(args.input, newline = '')
 
-        prog.pretty_print()
+    dst = sys.stdout.buffer if args.output_format == 'binary' else sys.stdout
+    progress = batch.Progress(total, args.progress_interval)
+    totals = collections.Counter()
+    with src:
+        if args.input_format == corpus.FORMAT:
+            outputs = batch.ordered_map(segment_entry, range(total), jobs, args.chunksize, initializer = init_worker, initargs = initargs)
+        else:
+            rows = records.read_rows(src, args.input_format)
+            outputs = batch.ordered_map(segment, rows, jobs, args.chunksize, initializer = init_worker, initargs = initargs)
+        if args.output_format == columnar.FORMAT:
+            written = columnar.write_columnar(args.output_dir, tally(outputs, totals))
+        else:
+            written = records.write_results(dst, args.output_format, tally(outputs, totals))
+        for _ in written:
+            progress.update()
+    dst.flush()
+    progress.close()
+    report(args, totals)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -52,7 +52,7 @@ class OpCode:
         self.push = push
         self.handler = handler
 
-    def execute(self:OpCode, stack:List[int], jump_dests:List[int], data:int, pos:int) -> List[int]:
+    def execute(self:OpCode, stack:List[int], jump_dests:JumpDests, data:int, pos:int) -> List[int]:
 
         if len(stack) < self.pop:
             raise Exception("stack underflow")
@@ -156,7 +156,37 @@ class OpCode:
         return self.code - LOG0.code if self.is_log() else 0
 
 
-def handleAdd(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos: int) -> List[int]:
+class JumpDests:
+    """Classifies jump targets of a code in constant time."""
+
+    INVALID = 0
+    VALID = 1
+    KNOWN_INVALID = 2   # not a jumpdest, but listed in GLOBALS.KNOWN_INVALID_JUMPDEST
+
+    def __init__(self, disassembly: Disassembly):
+        """
+        Args:
+          disassembly (Disassembly): instruction boundaries of the code, used to find JUMPDEST instructions
+        """
+        self.disassembly = disassembly
+        self.length = len(disassembly.code)
+        self.known_invalid = frozenset(GLOBALS.KNOWN_INVALID_JUMPDEST)
+
+    def kind(self, pos: int) -> int:
+        """Return VALID, KNOWN_INVALID or INVALID for the given jump target, None and other non integers are INVALID."""
+        if not isinstance(pos, int):
+            return JumpDests.INVALID
+        if 0 <= pos < self.length and self.disassembly.is_jumpdest(pos):
+            return JumpDests.VALID
+        if pos in self.known_invalid:
+            return JumpDests.KNOWN_INVALID
+        return JumpDests.INVALID
+
+    def __contains__(self, pos: int) -> bool:
+        return self.kind(pos) == JumpDests.VALID
+
+
+def handleAdd(ins: OpCode, stack: List[int], jump_dests: JumpDests, data:int, pos: int) -> List[int]:
 
     a = stack.pop()
     b = stack.pop()
@@ -169,52 +199,55 @@ def handleAdd(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, po
     return [pos+1]
 
 
-def handleDefault(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos: int) -> List[int]:
+def handleDefault(ins: OpCode, stack: List[int], jump_dests: JumpDests, data:int, pos: int) -> List[int]:
     for i in range(0,ins.pop):
         stack.pop()
     for i in range(0, ins.push):
         stack.append(None)
     return [pos+1]
 
-def handleInvalid(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos: int) -> List[int]:
+def handleInvalid(ins: OpCode, stack: List[int], jump_dests: JumpDests, data:int, pos: int) -> List[int]:
     return []
 
-def handleJump(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos: int) -> List[int]:
+def handleJump(ins: OpCode, stack: List[int], jump_dests: JumpDests, data:int, pos: int) -> List[int]:
     a = stack.pop()
+    kind = jump_dests.kind(a)
 
-    if a in jump_dests:
+    if kind == JumpDests.VALID:
         return [a]
 
-    if not a in jump_dests and not a in GLOBALS.KNOWN_INVALID_JUMPDEST:
+    if kind == JumpDests.INVALID:
         return [-1]
 
     return []
 
-def handleJumpI(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos: int) -> List[int]:
+def handleJumpI(ins: OpCode, stack: List[int], jump_dests: JumpDests, data:int, pos: int) -> List[int]:
     a = stack.pop()
     b = stack.pop()
 
+    kind = jump_dests.kind(a)
+
     ret = []
     if b == 0 or b == None:
         ret.append(pos+1)
     
-    if a in jump_dests and (b!=0 or b == None):
+    if kind == JumpDests.VALID and (b!=0 or b == None):
         ret.append(a)
 
     if a == None:
         return ret
 
-    if not a in jump_dests and not a in GLOBALS.KNOWN_INVALID_JUMPDEST:
+    if kind == JumpDests.INVALID:
         return [-1] + ret
 
     return ret
 
 
-def handlePushX(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos: int) -> List[int]:
+def handlePushX(ins: OpCode, stack: List[int], jump_dests: JumpDests, data:int, pos: int) -> List[int]:
     stack.append(data)
     return [pos + 1 + ins.push_len()]
 
-def handleAnd(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos: int) -> List[int]:
+def handleAnd(ins: OpCode, stack: List[int], jump_dests: JumpDests, data:int, pos: int) -> List[int]:
     a = stack.pop()
     b = stack.pop()
     if not a == None and not b == None:
@@ -223,41 +256,41 @@ def handleAnd(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, po
         stack.append(None)
     return [pos+1]
 
-def handleExtCodeSize(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos: int) -> List[int]:
+def handleExtCodeSize(ins: OpCode, stack: List[int], jump_dests: JumpDests, data:int, pos: int) -> List[int]:
     if stack.pop() == 0:
         stack.append(0)
     else:
         stack.append(None)
     return [pos+1]
 
-def handleSwapX(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos: int) -> List[int]:
+def handleSwapX(ins: OpCode, stack: List[int], jump_dests: JumpDests, data:int, pos: int) -> List[int]:
     swapPos = ins.code - SWAP1.code + 2    # the position the last value should be swapped with
     stack[-1], stack[-swapPos] = stack[-swapPos], stack[-1] # swap entries  
     return [pos+1]
 
-def handleDupX(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos: int) -> List[int]:
+def handleDupX(ins: OpCode, stack: List[int], jump_dests: JumpDests, data:int, pos: int) -> List[int]:
     dup = ins.code - DUP1.code + 1
     stack.append(stack[-dup])    
     return [pos+1]
 
-def handleStop(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos: int) -> List[int]:
+def handleStop(ins: OpCode, stack: List[int], jump_dests: JumpDests, data:int, pos: int) -> List[int]:
     return []
 
-def handleReturn(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos: int) -> List[int]:
+def handleReturn(ins: OpCode, stack: List[int], jump_dests: JumpDests, data:int, pos: int) -> List[int]:
     stack.pop()
     stack.pop()
     return []
 
-def handleSelfDestruct(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos: int) -> List[int]:
+def handleSelfDestruct(ins: OpCode, stack: List[int], jump_dests: JumpDests, data:int, pos: int) -> List[int]:
     stack.pop()
     return []
 
-def handleRevert(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos: int) -> List[int]:
+def handleRevert(ins: OpCode, stack: List[int], jump_dests: JumpDests, data:int, pos: int) -> List[int]:
     stack.pop()
     stack.pop()
     return []
 
-def handleLt(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos: int) -> List[int]:
+def handleLt(ins: OpCode, stack: List[int], jump_dests: JumpDests, data:int, pos: int) -> List[int]:
     a = stack.pop()
     b = stack.pop()
 
@@ -269,7 +302,7 @@ def handleLt(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos
         stack.append(0x00)
     return [pos+1]
 
-def handleIsZero(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos: int) -> List[int]:
+def handleIsZero(ins: OpCode, stack: List[int], jump_dests: JumpDests, data:int, pos: int) -> List[int]:
     a = stack.pop()
     if a == 0:
         stack.append(1)
@@ -279,7 +312,7 @@ def handleIsZero(ins: OpCode, stack: List[int], jump_dests: List[int], data:int,
         stack.append(0)
     return [pos+1]
 
-def handleMStore(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos: int) -> List[int]:
+def handleMStore(ins: OpCode, stack: List[int], jump_dests: JumpDests, data:int, pos: int) -> List[int]:
     
     for i in range(ins.pop):
         stack.pop()
@@ -287,7 +320,7 @@ def handleMStore(ins: OpCode, stack: List[int], jump_dests: List[int], data:int,
         stack.append(None)
     return [pos+1]
 
-def handleMultiply(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos: int) -> List[int]:
+def handleMultiply(ins: OpCode, stack: List[int], jump_dests: JumpDests, data:int, pos: int) -> List[int]:
     a = stack.pop()
     b = stack.pop()
 
@@ -297,7 +330,7 @@ def handleMultiply(ins: OpCode, stack: List[int], jump_dests: List[int], data:in
         stack.append(None)
     return [pos+1]
 
-def handleSubtract(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos: int) -> List[int]:
+def handleSubtract(ins: OpCode, stack: List[int], jump_dests: JumpDests, data:int, pos: int) -> List[int]:
     a = stack.pop()
     b = stack.pop()
 
@@ -307,7 +340,7 @@ def handleSubtract(ins: OpCode, stack: List[int], jump_dests: List[int], data:in
         stack.append(None)
     return [pos+1]
 
-def handleDiv(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos: int) -> List[int]:
+def handleDiv(ins: OpCode, stack: List[int], jump_dests: JumpDests, data:int, pos: int) -> List[int]:
     a = stack.pop()
     b = stack.pop()
 
@@ -320,7 +353,7 @@ def handleDiv(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, po
 
     return [pos+1]
    
-def handleSDiv(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos: int) -> List[int]:
+def handleSDiv(ins: OpCode, stack: List[int], jump_dests: JumpDests, data:int, pos: int) -> List[int]:
     a = stack.pop()
     b = stack.pop()
 
@@ -335,7 +368,7 @@ def handleSDiv(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, p
     
     return [pos+1]
 
-def handleMod(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos: int) -> List[int]:
+def handleMod(ins: OpCode, stack: List[int], jump_dests: JumpDests, data:int, pos: int) -> List[int]:
     a = stack.pop()
     b = stack.pop()
 
@@ -348,7 +381,7 @@ def handleMod(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, po
 
     return [pos+1]
 
-def handleAddMod(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos: int) -> List[int]:
+def handleAddMod(ins: OpCode, stack: List[int], jump_dests: JumpDests, data:int, pos: int) -> List[int]:
     a = stack.pop()
     b = stack.pop()
     c = stack.pop()
@@ -363,7 +396,7 @@ def handleAddMod(ins: OpCode, stack: List[int], jump_dests: List[int], data:int,
     return [pos+1]
 
 
-def handleMulMod(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos: int) -> List[int]:
+def handleMulMod(ins: OpCode, stack: List[int], jump_dests: JumpDests, data:int, pos: int) -> List[int]:
     a = stack.pop()
     b = stack.pop()
     c = stack.pop()
@@ -377,12 +410,15 @@ def handleMulMod(ins: OpCode, stack: List[int], jump_dests: List[int], data:int,
 
     return [pos+1]
 
-def handleExp(ins: OpCode, stack: List[int], jump_dests: List[int], data:int, pos: int) -> List[int]:
+def handleExp(ins: OpCode, stack: List[int], jump_dests: JumpDests, data:int, pos: int) -> List[int]:
     a = stack.pop()
     b = stack.pop()
 
     if a != None and b != None:
-        if (not GLOBALS.MAX_EXPONENT_CAP) or (b < GLOBALS.MAX_EXPONENT_CAP_VALUE):
+        if b < 0:
+            # negative values are left by SUB, their power is no integer
+            stack.append(None)
+        elif (not GLOBALS.MAX_EXPONENT_CAP) or (b < GLOBALS.MAX_EXPONENT_CAP_VALUE):
             stack.append((a ** b) % (2 ** 256))
         else:
             stack.append(None)
@@ -616,8 +652,8 @@ def missing_opcode(val: int) -> OpCode:
         raise ValueError(f"Opcode {hex(val)} exists.")
     return OpCode("MISSING", val, 0, 0,handleInvalid)
 
+ALL_OPCODES = [BYTECODES[val] if val in BYTECODES else missing_opcode(val) for val in range(256)]
+"""List of OpCode objects for every byte value, unknown values map to MISSING opcodes"""
+
 def all_opcode_by_value(val: int) -> OpCode:
-    if val in BYTECODES:
-        return BYTECODES[val]
-    else:
-        return missing_opcode(val)
+    return ALL_OPCODES[val]
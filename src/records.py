@@ -0,0 +1,120 @@
+"""
+streaming readers and writers for batch runs, all of them are generators so only the rows in flight are kept in memory
+
+input rows are (codeid, address, code) with code as hex string, decoding is left to the worker
+results are (codeid, length of the code, blocks as returned by EtherSeg::get_blocks, truncated)
+truncated is set if the analysis ran out of budget, the text format cannot show it
+"""
+
+from __future__ import annotations
+
+import csv
+import json
+import struct
+from block import BlockType
+from etherseg import pretty_lines
+from typing import BinaryIO, Dict, Iterable, Iterator, List, TextIO, Tuple
+
+Row = Tuple[str, str, str]
+Result = Tuple[str, int, List[Tuple[int,int,BlockType,int]], bool]
+
+INPUT_FORMATS = ('csv', 'jsonl')
+OUTPUT_FORMATS = ('text', 'jsonl', 'binary')
+
+# binary format: every result is a header followed by its segments, all little endian
+# header: codeid length (u16), codeid (utf-8), length of the code (u32), number of segments (u32), flags (u8)
+# segment: start (u32), end (u32), type (u8), base (u32, NO_BASE if None)
+HEADER = struct.Struct('<H')
+COUNTS = struct.Struct('<IIB')
+FLAG_TRUNCATED = 0x01
+SEGMENT = struct.Struct('<IIBI')
+NO_BASE = 0xffffffff
+TYPE_CODES = {BlockType.CODE: 0, BlockType.META: 1, BlockType.DATA: 2}
+CODE_TYPES = {v: k for k, v in TYPE_CODES.items()}
+
+def read_csv(fp: TextIO) -> Iterator[Row]:
+    for row in csv.reader(fp):
+        if len(row) < 3 or row[0] == 'codeid':
+            continue
+        yield (row[0], row[1], row[2])
+
+def read_jsonl(fp: TextIO) -> Iterator[Row]:
+    for line in fp:
+        if line.strip() == '':
+            continue
+        obj = json.loads(line)
+        yield (str(obj.get('codeid')), obj.get('address'), obj['code'])
+
+def read_rows(fp: TextIO, fmt: str) -> Iterator[Row]:
+    if fmt == 'csv':
+        return read_csv(fp)
+    elif fmt == 'jsonl':
+        return read_jsonl(fp)
+    raise ValueError(f"unknown input format {fmt}")
+
+def read_rows_at(fp: BinaryIO, fmt: str) -> Iterator[Tuple[int,Row]]:
+    """
+    rows of a file opened in binary mode, each with the offset behind the row before it,
+    read_rows on the file seeked to that offset starts with the row
+    """
+    pos = fp.tell()
+    def lines() -> Iterator[str]:
+        nonlocal pos
+        # both readers take one line at a time, so pos is always the end of what they consumed
+        for line in fp:
+            pos += len(line)
+            yield line.decode('utf-8')
+    start = pos
+    for row in read_rows(lines(), fmt):
+        yield start, row
+        start = pos
+
+def write_text(fp: TextIO, results: Iterable[Result]) -> Iterator[Result]:
+    for r in results:
+        for line in pretty_lines(r[2], r[1]):
+            fp.write(line + '\n')
+        yield r
+
+def result_object(r: Result) -> Dict:
+    """json form of a result, as written by write_jsonl"""
+    blocks = [[b[0], b[1], b[2].value, b[3]] for b in r[2]]
+    obj = {'codeid': r[0], 'length': r[1], 'blocks': blocks}
+    if r[3]:
+        obj['truncated'] = True
+    return obj
+
+def write_jsonl(fp: TextIO, results: Iterable[Result]) -> Iterator[Result]:
+    for r in results:
+        fp.write(json.dumps(result_object(r), separators = (',', ':')) + '\n')
+        yield r
+
+def pack_blocks(blocks: List[Tuple[int,int,BlockType,int]]) -> bytes:
+    return b''.join(SEGMENT.pack(b[0], b[1], TYPE_CODES[b[2]], NO_BASE if b[3] is None else b[3]) for b in blocks)
+
+def unpack_blocks(data: bytes) -> List[Tuple[int,int,BlockType,int]]:
+    return [(start, end, CODE_TYPES[btype], None if base == NO_BASE else base) for start, end, btype, base in SEGMENT.iter_unpack(data)]
+
+def write_binary(fp: BinaryIO, results: Iterable[Result]) -> Iterator[Result]:
+    for r in results:
+        codeid = r[0].encode('utf-8')
+        fp.write(HEADER.pack(len(codeid)) + codeid + COUNTS.pack(r[1], len(r[2]), FLAG_TRUNCATED if r[3] else 0) + pack_blocks(r[2]))
+        yield r
+
+def read_binary(fp: BinaryIO) -> Iterator[Result]:
+    while True:
+        head = fp.read(HEADER.size)
+        if len(head) < HEADER.size:
+            return
+        codeid = fp.read(HEADER.unpack(head)[0]).decode('utf-8')
+        length, count, flags = COUNTS.unpack(fp.read(COUNTS.size))
+        yield (codeid, length, unpack_blocks(fp.read(count * SEGMENT.size)), bool(flags & FLAG_TRUNCATED))
+
+def write_results(fp: TextIO, fmt: str, results: Iterable[Result]) -> Iterator[Result]:
+    """writes the results to fp as they pass through, fp has to be binary for the binary format"""
+    if fmt == 'text':
+        return write_text(fp, results)
+    elif fmt == 'jsonl':
+        return write_jsonl(fp, results)
+    elif fmt == 'binary':
+        return write_binary(fp, results)
+    raise ValueError(f"unknown output format {fmt}")
@@ -0,0 +1,277 @@
+#!/usr/bin/python3
+"""
+long running segmentation service, so interpreter and module startup are paid once instead of per call
+
+speaks a minimal HTTP/1.1 on a tcp port or a unix socket, endpoints:
+  POST /segment  body is the code, binary with Content-Type application/octet-stream, otherwise as hex string
+                 answers {"length": .., "blocks": [[start, end, type, base], ..]} and "truncated": true if the budget ran out
+  GET /health    {"status": "ok"}, 503 if the batcher stopped
+  GET /stats     counters of the server, with --stats also the time per phase and the counters of the analysis
+
+requests are put into a bounded queue, a batcher collects them into micro batches that are sent to a warm process pool,
+at most a few batches per worker are in flight, a full queue is answered with 503 right away
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import sys
+import records
+from main import add_worker_arguments, analyse, init_worker, worker_args
+from typing import Dict, List, Optional, Tuple, Union
+
+"""largest accepted request body in bytes, hex encoded code is twice as long as the code"""
+MAX_BODY_SIZE: int = 1 << 20
+
+"""http status lines used by the server"""
+REASONS: Dict[int,str] = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 411: 'Length Required',
+                          413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+class HttpError(Exception):
+
+    def __init__(self: HttpError, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+def _run_batch(codes: List[bytes]) -> List[Union[Tuple[List, bool, Dict[str,int]], str]]:
+    """results of the codes, a code whose analysis raised gets the message of the error instead"""
+    ret = []
+    for code in codes:
+        try:
+            ret.append(analyse(code))
+        except Exception as e:
+            ret.append(repr(e))
+    return ret
+
+def parse_code(body: bytes, content_type: str) -> bytes:
+    if content_type.split(';')[0].strip() == 'application/octet-stream':
+        return body
+    text = body.strip()
+    if text[0:2] in (b'0x', b'0X'):
+        text = text[2:]
+    try:
+        return bytes.fromhex(text.decode('ascii'))
+    except (UnicodeDecodeError, ValueError):
+        raise HttpError(400, "body is neither binary nor hex encoded code")
+
+class Server:
+
+    def __init__(self: Server, jobs: int = 1, queue_size: int = 1024, batch_size: int = 32, batch_bytes: int = 1 << 16,
+                 batch_delay: float = 0.002, window: int = 2, worker_args: tuple = ()):
+        """
+        Args:
+          jobs (int): number of worker processes
+          queue_size (int): requests waiting for a worker, further requests are rejected with 503
+          batch_size (int): most requests sent to a worker at once
+          batch_bytes (int): a batch is sent once its codes are that large, bigger codes go alone
+          batch_delay (float): seconds the batcher waits for more requests before it sends a batch that is not full
+          window (int): batches in flight per worker
+          worker_args (tuple): arguments of init_worker in main.py
+        """
+        self.jobs = jobs
+        self.worker_args = worker_args
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.batch_delay = batch_delay
+        self.queue = asyncio.Queue(queue_size)
+        self.slots = asyncio.Semaphore(jobs * window)
+        self.pool = self.__new_pool()
+        self.counts = collections.Counter()
+        self.batcher = None
+
+    def __new_pool(self: Server) -> concurrent.futures.ProcessPoolExecutor:
+        # workers are started once requests run, forked from here they would keep the sockets of all open connections
+        return concurrent.futures.ProcessPoolExecutor(self.jobs, mp_context = multiprocessing.get_context('forkserver'),
+                                                      initializer = init_worker, initargs = self.worker_args)
+
+    async def segment(self: Server, code: bytes) -> Tuple[List, bool]:
+        """blocks and truncated flag of the code, raises HttpError(503) if the queue is full"""
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((code, future))
+        except asyncio.QueueFull:
+            self.counts['rejected'] += 1
+            raise HttpError(503, "too many pending requests")
+        return await future
+
+    async def run_batches(self: Server) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.batch_delay
+            while len(batch) < self.batch_size and size < self.batch_bytes:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += len(item[0])
+            # waiting for a slot keeps the queue filled, so backpressure reaches the clients
+            await self.slots.acquire()
+            self.counts['batches'] += 1
+            pool = self.pool
+            try:
+                future = loop.run_in_executor(pool, _run_batch, [x[0] for x in batch])
+            except Exception as e:
+                self.slots.release()
+                self.__fail(batch, pool, e)
+                continue
+            future.add_done_callback(lambda f, batch = batch, pool = pool: self.__finish(f, batch, pool))
+
+    def __finish(self: Server, future: asyncio.Future, batch: List[Tuple[bytes,asyncio.Future]],
+                 pool: concurrent.futures.ProcessPoolExecutor) -> None:
+        self.slots.release()
+        error = asyncio.CancelledError() if future.cancelled() else future.exception()
+        if error is not None:
+            self.__fail(batch, pool, error)
+            return
+        for (_, f), result in zip(batch, future.result()):
+            if f.done():
+                continue
+            if isinstance(result, str):
+                self.counts['failed_requests'] += 1
+                f.set_exception(HttpError(500, f"analysis failed: {result}"))
+                continue
+            blocks, truncated, counts = result
+            self.counts.update(counts)
+            f.set_result((blocks, truncated))
+
+    def __fail(self: Server, batch: List[Tuple[bytes,asyncio.Future]], pool: concurrent.futures.ProcessPoolExecutor,
+               error: BaseException) -> None:
+        self.counts['failed_batches'] += 1
+        status = 500
+        if isinstance(error, concurrent.futures.BrokenExecutor):
+            # a worker died, the pool refuses all work from now on and is replaced once for all of its batches
+            status = 503
+            if pool is self.pool:
+                self.counts['pool_restarts'] += 1
+                pool.shutdown(wait = False, cancel_futures = True)
+                self.pool = self.__new_pool()
+        for _, f in batch:
+            if not f.done():
+                f.set_exception(HttpError(status, f"analysis failed: {error!r}"))
+
+    async def handle(self: Server, method: str, path: str, headers: Dict[str,str], body: bytes) -> Dict:
+        if path == '/health':
+            if self.batcher is not None and self.batcher.done():
+                error = None if self.batcher.cancelled() else self.batcher.exception()
+                raise HttpError(503, f"batcher stopped: {error!r}")
+            return {'status': 'ok'}
+        if path == '/stats':
+            return dict(self.counts, queued = self.queue.qsize())
+        if path != '/segment':
+            raise HttpError(404, f"unknown path {path}")
+        if method != 'POST':
+            raise HttpError(405, "use POST")
+        code = parse_code(body, headers.get('content-type', ''))
+        self.counts['requests'] += 1
+        blocks, truncated = await self.segment(code)
+        obj = records.result_object((None, len(code), blocks, truncated))
+        del obj['codeid']
+        return obj
+
+    async def connection(self: Server, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                try:
+                    status, obj = 200, await self.handle(method, path, headers, body)
+                except HttpError as e:
+                    status, obj = e.status, {'error': str(e)}
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(response(status, obj, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except HttpError as e:
+            # the request could not be parsed, the connection is not usable anymore
+            writer.write(response(e.status, {'error': str(e)}, False))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self: Server, host: str = '127.0.0.1', port: int = 8545, unix: Optional[str] = None) -> None:
+        self.batcher = asyncio.ensure_future(self.run_batches())
+        if unix is not None:
+            server = await asyncio.start_unix_server(self.connection, unix)
+        else:
+            server = await asyncio.start_server(self.connection, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.batcher.cancel()
+            self.pool.shutdown(cancel_futures = True)
+
+async def read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str,str,Dict[str,str],bytes]]:
+    """method, path, headers with lowercase names and body of the next request, None if the client closed the connection"""
+    line = await reader.readline()
+    if line == b'':
+        return None
+    parts = line.decode('latin-1').split()
+    if len(parts) != 3:
+        raise HttpError(400, "malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if 'transfer-encoding' in headers:
+        raise HttpError(411, "chunked bodies are not supported, send a Content-Length")
+    if not headers.get('content-length', '0').isdigit():
+        raise HttpError(400, "malformed Content-Length")
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY_SIZE:
+        raise HttpError(413, f"body is larger than {MAX_BODY_SIZE} bytes")
+    body = await reader.readexactly(length) if length > 0 else b''
+    return parts[0], parts[1].split('?')[0], headers, body
+
+def response(status: int, obj: Dict, keep_alive: bool = True) -> bytes:
+    body = json.dumps(obj, separators = (',', ':')).encode()
+    head = (f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode('latin-1') + body
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "serves the segmentation of bytecode as json over http")
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8545)
+    parser.add_argument('--unix', default = None, help = "listen on this unix socket instead of host and port")
+    parser.add_argument('-j', '--jobs', type = int, default = 0, help = "number of worker processes, 0 uses all cores")
+    parser.add_argument('--queue-size', type = int, default = 1024, help = "pending requests, further ones are answered with 503")
+    parser.add_argument('--batch-size', type = int, default = 32, help = "most requests sent to a worker at once")
+    parser.add_argument('--batch-delay', type = float, default = 0.002, help = "seconds to wait for more requests of a batch")
+    add_worker_arguments(parser)
+    args = parser.parse_args()
+
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+
+    async def run() -> None:
+        server = Server(jobs, args.queue_size, args.batch_size, batch_delay = args.batch_delay, worker_args = worker_args(args))
+        await server.serve(args.host, args.port, args.unix)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        print("stopped", file = sys.stderr)
+
+if __name__ == '__main__':
+    main()
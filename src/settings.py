@@ -0,0 +1,21 @@
+"""fingerprint of the analysis settings, used to key cached results"""
+
+from __future__ import annotations
+
+import hashlib
+import GLOBALS
+
+"""bump when a change to the analysis changes its results, old entries are ignored afterwards"""
+CACHE_VERSION: int = 3
+
+def settings_fingerprint() -> bytes:
+    h = hashlib.sha256(f"version {CACHE_VERSION}".encode())
+    for name in sorted(vars(GLOBALS)):
+        if not name.isupper():
+            continue
+        value = getattr(GLOBALS, name)
+        if callable(value):
+            # lambdas have no stable repr, their bytecode and constants describe them
+            value = (value.__code__.co_code, value.__code__.co_consts)
+        h.update(f"{name}={value!r};".encode())
+    return h.digest()
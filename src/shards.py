@@ -0,0 +1,292 @@
+#!/usr/bin/python3
+"""
+resumable batch runs split into deterministic shards, any number of nodes can work on one run through a shared directory
+
+  python shards.py run WORK corpus.csv --shard-rows 10000 -j 0     on every node, again after a crash
+  python shards.py status WORK
+  python shards.py merge WORK result.txt                           once all shards are done
+
+shard k are the rows k * shard_rows up to (k + 1) * shard_rows of the input, fixed by plan.json which the first node writes,
+for csv and jsonl the plan also keeps the byte offset of every shard, so a node seeks to its shard instead of reading up to it
+a node claims a shard by creating shard-NNNNN.lock with its host and pid, claims that were not touched for --lease seconds
+or whose process on this host is gone are taken over, run exits with 1 if shards claimed by other nodes are not done yet
+the output of a shard is written to shard-NNNNN.out and completed by shard-NNNNN.done with its counters,
+both are written under another name and renamed, so a shard is either done or redone from its start
+"""
+
+from __future__ import annotations
+
+import argparse
+import collections
+import contextlib
+import glob
+import hashlib
+import io
+import itertools
+import json
+import os
+import socket
+import sys
+import time
+import batch
+import corpus
+import records
+from corpus import Corpus
+from main import add_worker_arguments, init_worker, report, segment, segment_entry, tally, worker_args
+from settings import settings_fingerprint
+from typing import Dict, Iterator, List, Optional, Tuple
+
+"""seconds after which the claim of a node that stopped touching it is taken over"""
+LEASE: float = 600.0
+
+"""seconds between two touches of a claim while its shard is running"""
+TOUCH_INTERVAL: float = 10.0
+
+def shard_path(work: str, shard: int, suffix: str) -> str:
+    return os.path.join(work, f"shard-{shard:05}.{suffix}")
+
+def node_suffix() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def write_temp(path: str, data: bytes) -> str:
+    tmp = f"{path}.tmp-{node_suffix()}"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp
+
+def write_atomic(path: str, data: bytes) -> None:
+    os.replace(write_temp(path, data), path)
+
+def load_plan(work: str) -> Dict:
+    with open(os.path.join(work, 'plan.json')) as f:
+        return json.load(f)
+
+def input_fingerprint(path: str) -> str:
+    """hash of the size, the first and the last MiB of the input, cheap for any size but changes with the file"""
+    size = os.path.getsize(path)
+    h = hashlib.sha256(str(size).encode())
+    with open(path, 'rb') as f:
+        h.update(f.read(1 << 20))
+        f.seek(max(size - (1 << 20), 0))
+        h.update(f.read(1 << 20))
+    return h.hexdigest()
+
+def count_rows(path: str, fmt: str, shard_rows: int) -> Tuple[int, Optional[List[int]]]:
+    """number of rows and byte offset of the first row of every shard, no offsets for the corpus which is indexed anyway"""
+    if fmt == corpus.FORMAT:
+        with Corpus(path) as c:
+            return len(c), None
+    rows = 0
+    offsets = []
+    with open(path, 'rb') as f:
+        for pos, _ in records.read_rows_at(f, fmt):
+            if rows % shard_rows == 0:
+                offsets.append(pos)
+            rows += 1
+    return rows, offsets
+
+def make_plan(args: argparse.Namespace) -> Dict:
+    """the plan of the run in args.work, written by the first node, every other node has to agree with it"""
+    # everything that changes the output of a shard, deadline excepted as it depends on the node anyway
+    # and the input itself, its rows and byte offsets are fixed by the plan
+    wanted = {'input_format': args.input_format, 'output_format': args.output_format, 'shard_rows': args.shard_rows,
+              'max_steps': args.max_steps, 'settings': settings_fingerprint().hex(),
+              'input_size': os.path.getsize(args.input), 'input_hash': input_fingerprint(args.input)}
+    path = os.path.join(args.work, 'plan.json')
+    if not os.path.exists(path):
+        rows, offsets = count_rows(args.input, args.input_format, args.shard_rows)
+        plan = dict(wanted, input = args.input, rows = rows, shards = (rows + args.shard_rows - 1) // args.shard_rows, offsets = offsets)
+        os.makedirs(args.work, exist_ok = True)
+        tmp = write_temp(path, json.dumps(plan, indent = 1).encode())
+        # link fails if the file exists, so the first complete plan wins and every node reads that one
+        with contextlib.suppress(FileExistsError):
+            os.link(tmp, path)
+        os.remove(tmp)
+    plan = load_plan(args.work)
+    for k, v in wanted.items():
+        if plan[k] != v:
+            raise SystemExit(f"{k} is {v!r} but the run in {args.work} uses {plan[k]!r}")
+    return plan
+
+def owner(lock: str) -> str:
+    """node_suffix of the node holding the claim, empty while it is still being written"""
+    with open(lock) as f:
+        return f.readline().strip()
+
+def alive(node: str) -> bool:
+    """false if node is a process of this host that has ended, nodes of other hosts are only known by their lease"""
+    host, _, pid = node.rpartition('-')
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def claim(work: str, shard: int, lease: float) -> bool:
+    """true if this node now owns the shard"""
+    lock = shard_path(work, shard, 'lock')
+    for _ in range(2):
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(lock).st_mtime < lease and alive(owner(lock)):
+                    return False
+                # the owner stopped touching its claim, only one node can move it away
+                os.rename(lock, f"{lock}.stale-{node_suffix()}")
+                os.remove(f"{lock}.stale-{node_suffix()}")
+            except FileNotFoundError:
+                pass
+            continue
+        with os.fdopen(fd, 'w') as f:
+            f.write(node_suffix() + '\n')
+        return True
+    return False
+
+def release(work: str, shard: int) -> None:
+    """removes the claim unless another node took it over meanwhile"""
+    lock = shard_path(work, shard, 'lock')
+    with contextlib.suppress(FileNotFoundError):
+        if owner(lock) == node_suffix():
+            os.remove(lock)
+
+def shard_rows(args: argparse.Namespace, plan: Dict, shard: int) -> Iterator:
+    start = shard * plan['shard_rows']
+    stop = min(start + plan['shard_rows'], plan['rows'])
+    if plan['input_format'] == corpus.FORMAT:
+        yield from range(start, stop)
+        return
+    with open(args.input, 'rb') as f:
+        f.seek(plan['offsets'][shard])
+        with io.TextIOWrapper(f, encoding = 'utf-8', newline = '') as text:
+            yield from itertools.islice(records.read_rows(text, plan['input_format']), stop - start)
+
+def run_shard(args: argparse.Namespace, plan: Dict, shard: int, jobs: int, initargs: tuple, progress: batch.Progress) -> collections.Counter:
+    lock = shard_path(args.work, shard, 'lock')
+    out = shard_path(args.work, shard, 'out')
+    tmp = f"{out}.tmp-{node_suffix()}"
+    fn = segment_entry if plan['input_format'] == corpus.FORMAT else segment
+    counts = collections.Counter()
+    # leftovers of nodes that died while running this shard
+    for old in glob.glob(out + '.tmp-*'):
+        with contextlib.suppress(FileNotFoundError):
+            if time.time() - os.stat(old).st_mtime >= args.lease:
+                os.remove(old)
+    touched = time.time()
+    with open(tmp, 'wb' if plan['output_format'] == 'binary' else 'w') as dst:
+        outputs = batch.ordered_map(fn, shard_rows(args, plan, shard), jobs, args.chunksize, initializer = init_worker, initargs = initargs)
+        n = 0
+        for _ in records.write_results(dst, plan['output_format'], tally(outputs, counts)):
+            n += 1
+            progress.update()
+            # keeps the claim alive
+            if time.time() - touched >= TOUCH_INTERVAL:
+                touched = time.time()
+                with contextlib.suppress(FileNotFoundError):
+                    os.utime(lock)
+        dst.flush()
+        os.fsync(dst.fileno())
+    os.replace(tmp, out)
+    write_atomic(shard_path(args.work, shard, 'done'), json.dumps({'rows': n, 'counts': counts, 'node': node_suffix()}).encode())
+    release(args.work, shard)
+    return counts
+
+def done(work: str, shard: int) -> Optional[Dict]:
+    try:
+        with open(shard_path(work, shard, 'done')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def run(args: argparse.Namespace) -> None:
+    plan = make_plan(args)
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+    initargs = worker_args(args)
+    if plan['input_format'] == corpus.FORMAT:
+        initargs += (args.input,)
+    totals = collections.Counter()
+    progress = batch.Progress(None, args.progress_interval)
+    # nodes start at different shards, so they rarely race for the same claim
+    first = (hash(socket.gethostname()) + os.getpid()) % max(plan['shards'], 1)
+    for shard in itertools.chain(range(first, plan['shards']), range(first)):
+        if done(args.work, shard) is not None or not claim(args.work, shard, args.lease):
+            continue
+        # another node may have finished it between the check and the claim
+        if done(args.work, shard) is not None:
+            release(args.work, shard)
+            continue
+        totals.update(run_shard(args, plan, shard, jobs, initargs, progress))
+    progress.close()
+    report(args, totals)
+    missing = [k for k in range(plan['shards']) if done(args.work, k) is None]
+    if len(missing) > 0:
+        raise SystemExit(f"{len(missing)} shards are claimed by other nodes and not done yet, the first is {missing[0]}, "
+                         f"run again once they are done or their claims are older than --lease")
+
+def status(args: argparse.Namespace) -> None:
+    plan = load_plan(args.work)
+    finished = sum(1 for k in range(plan['shards']) if done(args.work, k) is not None)
+    claimed = sum(1 for k in range(plan['shards']) if done(args.work, k) is None and os.path.exists(shard_path(args.work, k, 'lock')))
+    print(f"{finished}/{plan['shards']} shards done, {claimed} claimed, {plan['shards'] - finished - claimed} pending, {plan['rows']} rows")
+
+def merge(args: argparse.Namespace) -> None:
+    """concatenates the shard outputs in shard order, all output formats can be concatenated"""
+    plan = load_plan(args.work)
+    missing = [k for k in range(plan['shards']) if done(args.work, k) is None]
+    if len(missing) > 0:
+        raise SystemExit(f"{len(missing)} shards are not done yet, the first is {missing[0]}")
+    totals = collections.Counter()
+    tmp = f"{args.output}.tmp-{node_suffix()}"
+    with open(tmp, 'wb') as dst:
+        for k in range(plan['shards']):
+            totals.update(done(args.work, k)['counts'])
+            with open(shard_path(args.work, k, 'out'), 'rb') as src:
+                while True:
+                    chunk = src.read(1 << 20)
+                    if chunk == b'':
+                        break
+                    dst.write(chunk)
+    os.replace(tmp, args.output)
+    print(f"{plan['rows']} rows of {plan['shards']} shards merged into {args.output}", file = sys.stderr)
+    if totals['truncated'] > 0:
+        print(f"{totals['truncated']} rows ran out of budget and are truncated", file = sys.stderr)
+    if totals['errors'] > 0:
+        print(f"{totals['errors']} rows failed and have no blocks", file = sys.stderr)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "resumable batch runs in shards that many nodes can share")
+    commands = parser.add_subparsers(dest = 'command', required = True)
+
+    p = commands.add_parser('run', help = "segments all shards that are not done or claimed")
+    p.add_argument('work', help = "shared directory of the run")
+    p.add_argument('input', help = "input file, the same on every node")
+    p.add_argument('--shard-rows', type = int, default = 10000, help = "rows per shard, fixed by the first node")
+    p.add_argument('-j', '--jobs', type = int, default = 1, help = "number of worker processes, 0 uses all cores")
+    p.add_argument('--chunksize', type = int, default = 64, help = "rows sent to a worker at once")
+    p.add_argument('--lease', type = float, default = LEASE, help = "seconds after which an untouched claim is taken over")
+    p.add_argument('--progress-interval', type = float, default = 10.0, help = "seconds between progress lines")
+    p.add_argument('--input-format', choices = records.INPUT_FORMATS + (corpus.FORMAT,), default = 'csv')
+    p.add_argument('--output-format', choices = records.OUTPUT_FORMATS, default = 'text')
+    add_worker_arguments(p)
+    p.set_defaults(fn = run)
+
+    p = commands.add_parser('status', help = "prints how many shards are done")
+    p.add_argument('work')
+    p.set_defaults(fn = status)
+
+    p = commands.add_parser('merge', help = "writes the outputs of all shards in order to one file")
+    p.add_argument('work')
+    p.add_argument('output')
+    p.set_defaults(fn = merge)
+
+    args = parser.parse_args()
+    args.fn(args)
+
+if __name__ == '__main__':
+    main()
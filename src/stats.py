@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import collections
+import contextlib
+import time
+from typing import ContextManager, Dict, Iterator
+
+"""prefixes of the keys in Stats::as_dict"""
+TIME_PREFIX: str = "time."
+COUNT_PREFIX: str = "count."
+
+class Stats:
+    """
+    wall time per phase and counters of one or more analyses, opt-in through EtherSeg(code, stats = Stats())
+    counters: blocks_created, block_executions, status_<value> for the Status every execution ended with,
+    known_stack_hits, exceptions of failed subprograms, secondary_targets, subprograms, subprograms_skipped and subcode_cache_hits
+    """
+
+    def __init__(self: Stats):
+        self.times = collections.Counter()     # phase -> seconds
+        self.counts = collections.Counter()
+
+    @contextlib.contextmanager
+    def phase(self: Stats, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] += time.perf_counter() - start
+
+    def count(self: Stats, name: str, n: int = 1) -> None:
+        self.counts[name] += n
+
+    def update(self: Stats, other: Stats) -> None:
+        self.times.update(other.times)
+        self.counts.update(other.counts)
+
+    def as_dict(self: Stats) -> Dict[str,float]:
+        """flat form that can be summed up with collections.Counter and read back with from_dict"""
+        ret = {TIME_PREFIX + k: v for k, v in self.times.items()}
+        ret.update({COUNT_PREFIX + k: v for k, v in self.counts.items()})
+        return ret
+
+    @staticmethod
+    def from_dict(values: Dict[str,float]) -> Stats:
+        """inverse of as_dict, other keys are ignored"""
+        stats = Stats()
+        for k, v in values.items():
+            if k.startswith(TIME_PREFIX):
+                stats.times[k[len(TIME_PREFIX):]] += v
+            elif k.startswith(COUNT_PREFIX):
+                stats.counts[k[len(COUNT_PREFIX):]] += v
+        return stats
+
+    def lines(self: Stats) -> Iterator[str]:
+        total = sum(self.times.values())
+        for name, seconds in self.times.most_common():
+            yield f"{name}: {seconds:.3f}s ({seconds / total * 100 if total > 0 else 0:.1f}%)"
+        for name, n in sorted(self.counts.items()):
+            yield f"{name}: {n}"
+
+# reused for every phase of an analysis without stats
+NO_PHASE = contextlib.nullcontext()
+
+def phase(stats: Stats, name: str) -> ContextManager:
+    """times the phase if stats is not None"""
+    return NO_PHASE if stats is None else stats.phase(name)
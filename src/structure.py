@@ -1,4 +1,4 @@
-import io,re,cbor2
+import bisect,re,cbor2
 import opcodes
 from block import *
 
@@ -22,6 +22,21 @@ DEPLOYMENT5 = b'(?<=\x80\x60.\x60\x00\x39\x60\x00\xf3)\x60'
 
 RE_CODE_START = re.compile(SOLIDITY_START + b'|' + DEPLOYMENT1 + b'|' + DEPLOYMENT2 + b'|' + DEPLOYMENT3 + b'|' + DEPLOYMENT4 + b'|' + DEPLOYMENT5, re.DOTALL)
 
+# every match of RE_CODE_START contains one of these literals, at the given offsets from the start of the match
+#   PUSH1 . PUSH1 40 of CONTRACT_OLD, CONTRACT_NEW and CONTRACT_NEW2, behind an optional PUSHPOP or LIBRARY_CHECK of up to 34 bytes
+#   PUSH1 00 RETURN in the lookbehind of DEPLOYMENT1, DEPLOYMENT2 and DEPLOYMENT5
+#   JUMP PUSH1 00 around the start of DEPLOYMENT3 and DEPLOYMENT4
+CODE_START_ANCHORS = [
+    (b'\x60\x40', range(2, 37)),
+    (b'\x60\x00\xf3', (-3, -4)),
+    (b'\x56\x60\x00', (-1,)),
+]
+# none of the anchors can overlap itself, so finditer sees every occurrence, it also works on memoryview and mmap
+CODE_START_ANCHOR_RES = [(re.compile(re.escape(anchor)), offsets) for anchor, offsets in CODE_START_ANCHORS]
+# longest lookbehind and longest match of RE_CODE_START
+CODE_START_LOOKBEHIND = 11
+CODE_START_LENGTH = 41
+
 STOP = b'\x00'
 JUMP = b'\x56'
 RETURN = b'\xf3'
@@ -34,18 +49,68 @@ IPFS  = b'ipfs'
 SOURCE_RE = re.compile(BZZR0 + b'|' + BZZR1 + b'|' + IPFS)
 METADATA_OFFSET = 50
 
-def matchMetadata(code,keyword):
-    try:
-        fp = io.BytesIO(code)
-        metadata = cbor2.load(fp)
-        rest = fp.read()
-        len_metadata = int.from_bytes(rest[:2],'big')
-        if len(rest) >= 2 and len(code) == len_metadata + len(rest) and keyword.decode('ascii') in metadata:
-            return code[:len_metadata+2]
+# cbor major types that can decode to something the keyword can be found in (text, array, map, tag)
+METADATA_MAJOR_TYPES = (3, 4, 5, 6)
+
+def cborLength(code,start,end):
+    # length of the cbor item at start computed from its headers only, None if it does not end before end
+    i = start
+    remaining = [1] # items left in every open container, None for indefinite length
+    while len(remaining) > 0:
+        if i >= end:
+            return None
+        major = code[i] >> 5
+        info = code[i] & 0x1f
+        i += 1
+        if info == 31:
+            if major in (2, 3, 4, 5):
+                remaining.append(None)
+                continue
+            elif major == 7 and remaining[-1] is None:
+                remaining.pop()
+            else:
+                return None
+        elif info > 27:
+            return None
         else:
-            return b''
-    except:
-        return b''
+            arg = info
+            if info >= 24:
+                size = 1 << (info - 24)
+                arg = int.from_bytes(code[i:i+size],'big')
+                i += size
+            if major in (2, 3):
+                i += arg
+            elif major == 4 and arg > 0:
+                remaining.append(arg)
+                continue
+            elif major == 5 and arg > 0:
+                remaining.append(2 * arg)
+                continue
+            elif major == 6:
+                continue
+        # one item is complete, close all containers that are complete with it
+        while len(remaining) > 0 and remaining[-1] is not None:
+            remaining[-1] -= 1
+            if remaining[-1] > 0:
+                break
+            remaining.pop()
+    return i - start if i <= end else None
+
+def matchMetadata(code,start,keyword):
+    # length of the metadata at start including its 2 byte length trailer, 0 if there is none
+    # cbor is only decoded if the header and the trailer fit, and then only the item itself
+    if code[start] >> 5 not in METADATA_MAJOR_TYPES:
+        return 0
+    len_metadata = cborLength(code,start,min(len(code) - 2,start + 0xffff))
+    if len_metadata is None or int.from_bytes(code[start+len_metadata:start+len_metadata+2],'big') != len_metadata:
+        return 0
+    try:
+        metadata = cbor2.loads(memoryview(code)[start:start+len_metadata])
+        if keyword.decode('ascii') in metadata:
+            return len_metadata + 2
+    except Exception:
+        pass
+    return 0
 
 def searchMetadata(code):
     parts = []
@@ -56,14 +121,14 @@ def searchMetadata(code):
         if source_match is None:
             break
         source_start = source_match.start()
-        metadata = b''
+        len_metadata = 0
         metadata_start = source_start
         for j in range(source_start-2,max(source_start-METADATA_OFFSET,0)-1,-1):
-            metadata = matchMetadata(code[j:],source_match[0])
-            if metadata != b'':
+            len_metadata = matchMetadata(code,j,source_match[0])
+            if len_metadata != 0:
                 metadata_start = j
                 break
-        metadata_end = metadata_start + len(metadata) 
+        metadata_end = metadata_start + len_metadata
         if metadata_end > source_start:
             if metadata_start > code_start:
                 parts.append((code_start,metadata_start - 1,BlockType.CODE))
@@ -76,12 +141,35 @@ def searchMetadata(code):
         parts.append((code_start,len(code),BlockType.CODE))
     return parts
 
-def splitCode(code,block):
+def codeStartCandidates(code):
+    # sorted positions RE_CODE_START may match at, found with one scan for each anchor over the whole code
+    candidates = set()
+    for anchor, offsets in CODE_START_ANCHOR_RES:
+        for m in anchor.finditer(code):
+            i = m.start()
+            candidates.update(i - o for o in offsets if i - o >= 0)
+    return sorted(candidates)
+
+def splitCode(code,block,candidates=None):
+    # same as running RE_CODE_START.finditer on code[block[0]:block[1]], but only tries the candidates
+    # every candidate is matched on a window that ends where the block ends, the lookbehinds cannot see before the block either
+    if candidates is None:
+        candidates = codeStartCandidates(code)
     i = block[0]
     parts = []
-    for m in RE_CODE_START.finditer(code[block[0]:block[1]]):
-        parts.append((i,block[0] + m.start()))
-        i = block[0] + m.start()
+    match_end = block[0]
+    lo = bisect.bisect_left(candidates,block[0])
+    hi = bisect.bisect_left(candidates,block[1],lo)
+    for c in candidates[lo:hi]:
+        if c < match_end:
+            continue    # matches do not overlap
+        window = max(block[0],c - CODE_START_LOOKBEHIND)
+        m = RE_CODE_START.match(code[window:min(block[1],c + CODE_START_LENGTH)],c - window)
+        if m is None:
+            continue
+        match_end = window + m.end()
+        parts.append((i,c))
+        i = c
     if i < block[1]:
         parts.append((i,block[1]))
     return parts
@@ -89,12 +177,13 @@ def splitCode(code,block):
 def decompose(code):
     parts = []
     preMeta = True
+    candidates = codeStartCandidates(code)
     for p in searchMetadata(code):
         if p[2] == BlockType.META:
             parts.append(p)
             preMeta = False
         else:
-            pc_parts = splitCode(code,p)
+            pc_parts = splitCode(code,p,candidates)
             if len(pc_parts) > 0:
                 if pc_parts[0][0] != pc_parts[0][1]:
                     if preMeta:
@@ -0,0 +1,72 @@
+"""
+in-memory cache of subprogram results, so a child contract that is embedded in many factories or also deployed on its own
+is only analysed once per process
+
+a subprogram only sees the code from its start on, the metadata behind it and where the next code start was predicted,
+together with the settings in GLOBALS they form the key, the code blocks are stored relative to the start
+along with the block executions the subprogram took, a hit is charged them so a step budget ends the analysis where it would without cache
+"""
+
+from __future__ import annotations
+
+import hashlib
+import struct
+from settings import settings_fingerprint
+from typing import List, Optional, Tuple
+
+class CachedSubProgram:
+    """result of a SubProgram taken from a SubcodeCache, provides the same base and code_blocks"""
+
+    __slots__ = ('base', 'blocks')
+
+    def __init__(self: CachedSubProgram, base: int, blocks: Tuple[Tuple[int,int,bool]]):
+        self.base = base
+        self.blocks = blocks
+
+    def code_blocks(self: CachedSubProgram) -> Tuple[Tuple[int,int,bool]]:
+        return self.blocks
+
+class SubcodeCache:
+
+    def __init__(self: SubcodeCache, max_entries: int = 4096):
+        """
+        Args:
+          max_entries (int): number of subprogram results kept, least recently used ones are dropped above it
+        """
+        self.max_entries = max_entries
+        self.fingerprint = settings_fingerprint()
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self: SubcodeCache, code: bytes, size: Tuple[int,int], meta: List[Tuple[int,int]]) -> bytes:
+        """
+        Args:
+          code (bytes): code of the subprogram, from its start to the end of the whole code
+          size (Tuple[int,int]): start of the subprogram and predicted end, as given to SubProgram
+          meta (List[Tuple[int,int]]): all metadata sections of the whole code
+        """
+        base = size[0]
+        h = hashlib.sha256(self.fingerprint)
+        h.update(struct.pack('<q', size[1] - base))
+        for m in meta:
+            if m[1] > base:
+                h.update(struct.pack('<qq', m[0] - base, m[1] - base))
+        h.update(b'code')
+        h.update(code)
+        return h.digest()
+
+    def get(self: SubcodeCache, key: bytes) -> Optional[Tuple[Tuple[Tuple[int,int,bool]],int]]:
+        """code blocks and block executions of the subprogram"""
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries[key] = entry  # most recently used entries are dropped last
+        self.hits += 1
+        return entry
+
+    def put(self: SubcodeCache, key: bytes, blocks: List[Tuple[int,int,bool]], steps: int) -> None:
+        self.entries[key] = (tuple(blocks), steps)
+        if len(self.entries) > self.max_entries:
+            del self.entries[next(iter(self.entries))]
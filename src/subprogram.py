@@ -1,14 +1,17 @@
 from __future__ import annotations
 from opcodes import *
-from block import BlockType, Block
+from block import BlockType, Block, Status
+from disassembly import Disassembly, IS_INVALID, ALTERS_FLOW
+from budget import Budget
+from stats import Stats, phase
 import GLOBALS
-from typing import List,Tuple
+from typing import Dict,List,Tuple
 
 class SubProgram:
 
     # sanitize codeblocks
     def __sanitize(self: Program) -> None:
-        temp = [value for (key, value) in sorted(self.blocks.items())]
+        temp = self.order
 
         for i in range(1,len(temp)-1):
             if (temp[i].btype == BlockType.META):
@@ -19,7 +22,7 @@ class SubProgram:
                 and temp[i].btype == BlockType.CODE     \
                 and not temp[i].executed                \
                 and temp[i-1].was_executed()            \
-                and temp[i].is_reachable(self.blocks):
+                and temp[i].is_reachable():
 
                 for j in range(i,len(temp)-1):
                     if temp[j].was_executed():
@@ -37,133 +40,180 @@ class SubProgram:
     def __create_blocks(self: SubProgram) -> None:
 
         blocks = {}
-        skip = 0
         in_data = False
 
         blocks[0] = (BlockType.CODE,[])
         if all_opcode_by_value(self.code[0]).halts():
             return
 
-        for i in range(len(self.code)):
-
-            if skip > 0:
-                skip -= 1
-                continue
-
-            for m in self.meta:
-                if m[0] <= i + self.base < m[1]:
+        # marks all positions that belong to metadata
+        in_meta = bytearray(len(self.code))
+        for m in self.meta:
+            lo = min(max(m[0] - self.base,0),len(self.code))
+            hi = min(max(m[1] - self.base,0),len(self.code))
+            in_meta[lo:hi] = b'\x01' * (hi - lo)
+
+        # decoding starts again behind every metadata section
+        pos = 0
+        while pos is not None:
+            start, pos = pos, None
+            for i in self.disassembly.walk(start,len(self.code)):
+
+                if in_meta[i]:
+                    m = next(m for m in self.meta if m[0] <= i + self.base < m[1])
                     blocks[m[0] - self.base] = (BlockType.META,[])
-                    skip = m[1] - (i + self.base)
-                    break             
-            
-            if skip > 0:
-                skip -= 1
-                continue
+                    pos = m[1] - self.base
+                    break
 
-            op = all_opcode_by_value(self.code[i])
-            
-            skip = op.push_len() #stuff can still be skipped do to how push in data works
+                op = self.code[i]
 
-            if in_data:
-                if op.is_invalid():
-                    continue
+                if in_data:
+                    if not IS_INVALID[op]:
+                        blocks[i] = (BlockType.CODE,[]) # now begins code
+                        in_data = False
                 else:
-                    blocks[i] = (BlockType.CODE,[]) # now begins code
-                    in_data = False
-                    continue
-            else:
-                if op == JUMPDEST:
-                    blocks[i] = (BlockType.CODE,[])
-                elif op.is_invalid():
-                    blocks[i] = (BlockType.DATA,None)
-                    in_data = True
-                elif op.alters_flow():
-                    if i + 2 < len(self.code):
-                        blocks[i+1] = (BlockType.DATA,None) if all_opcode_by_value(self.code[i+2]).is_invalid() else (BlockType.CODE,[])
-                        in_data = blocks[i+1][0] == BlockType.DATA
+                    if op == JUMPDEST.code:
+                        blocks[i] = (BlockType.CODE,[])
+                    elif IS_INVALID[op]:
+                        blocks[i] = (BlockType.DATA,None)
+                        in_data = True
+                    elif ALTERS_FLOW[op]:
+                        if i + 2 < len(self.code):
+                            blocks[i+1] = (BlockType.DATA,None) if IS_INVALID[self.code[i+2]] else (BlockType.CODE,[])
+                            in_data = blocks[i+1][0] == BlockType.DATA
 
         keys = sorted(blocks)
         for i in range(len(keys) - 1):
-            self.blocks[keys[i]] = Block(blocks[keys[i]][0],keys[i],keys[i+1],self.code,self.base)
-        self.blocks[keys[-1]] = Block(blocks[keys[-1]][0],keys[-1],len(self.code),self.code,self.base)
-
-    def __create_jump_dests(self) -> List[int]:
-        skip: int = 0 
-        jump_dests = []
-        for i in range(0,len(self.code)):
-            if skip > 0:    
-                skip -= 1
-                continue
-
-            skip = self.code[i] - PUSH1.code + 1 if PUSH1.code <= self.code[i] <= PUSH32.code else 0
-
-            if self.code[i] == JUMPDEST.code:
-                jump_dests.append(i)
-        return jump_dests
+            self.blocks[keys[i]] = Block(blocks[keys[i]][0],keys[i],keys[i+1],self.disassembly,self.base)
+        self.blocks[keys[-1]] = Block(blocks[keys[-1]][0],keys[-1],len(self.code),self.disassembly,self.base)
+
+    # orders the blocks by position and links each block to its neighbours
+    def __link_blocks(self: SubProgram) -> None:
+        self.order: List[Block] = [value for (key, value) in sorted(self.blocks.items())]
+        for i in range(len(self.order)):
+            self.order[i].prev = self.order[i-1] if i > 0 else None
+            self.order[i].next = self.order[i+1] if i + 1 < len(self.order) else None
+
+    # reachability only depends on the previous block and code likelihood on the next one
+    # so one pass in each direction sets them for all blocks
+    def __analyse_blocks(self: SubProgram) -> None:
+        for b in self.order:
+            b.update_reachable()
+        for b in reversed(self.order):
+            b.update_likely_code()
+
+    def code_blocks(self:SubProgram) -> List[Tuple[int,int,bool]]:
+        """(start, end, used) of every code block in order, relative to base"""
+        return [(b.start, b.end, b.used_in is not None) for b in self.blocks.values() if b.btype == BlockType.CODE]
 
     def execute(self:SubProgram) -> None:
         if self.blocks[0].min_stack_size() > 0:
-            self.blocks = {0:Block(BlockType.DATA,0,len(self.code),self.code,self.base)}
+            self.blocks = {0:Block(BlockType.DATA,0,len(self.code),self.disassembly,self.base)}
+            self.__link_blocks()
             return
-        self.__execute()
-        self.__secondary_execution()
-        self.__sanitize()
+        with phase(self.stats, 'execute'):
+            self.__execute()
+        with phase(self.stats, 'analyse'):
+            self.__analyse_blocks()
+        with phase(self.stats, 'secondary_execution'):
+            self.__secondary_execution()
+        with phase(self.stats, 'sanitize'):
+            self.__sanitize()
 
     def __secondary_execution(self: SubProgram) -> None:
         if GLOBALS.SECONDARY_EXECUTION:
-            b = [x for x in self.blocks if self.blocks[x].btype == BlockType.CODE]
-            b.sort()
-
-            for i in range(len(b)-1,0,-1):
-                if not (self.blocks[b[i]].was_executed() or self.blocks[b[i]].most_likely_code(self.blocks)):
-                    del b[i]
-                else:
+            for b in self.order:
+                if b.btype != BlockType.CODE:
+                    continue
+                if b.true_start() >= self.predicted_end:
                     break
-            for i in b:
-                if i + self.base >= self.predicted_end:
+                if self.budget.exhausted:
                     break
-                if not self.blocks[i].was_executed() and self.blocks[i].most_likely_code(self.blocks): 
-                    try:
-                        self.__execute(i,[None]* GLOBALS.SECONDARY_STACK_SIZE(self.blocks[i].min_stack_size()))
-                    except Exception as e:
-                        pass
+                if not b.was_executed() and b.most_likely_code(): 
+                    if self.stats is not None:
+                        self.stats.count('secondary_targets')
+                    self.__execute(b.start,[None]* GLOBALS.SECONDARY_STACK_SIZE(b.min_stack_size()))
         
-    def __execute(self:SubProgram, start: int = 0, stack:List[int] = []) -> None:
+    # queues the execution of a block, items are [index of codeblock, stack to test that block on, stack key]
+    # an item without stack only has to be counted, its block is missing, no code or would stop before running (then it keeps the key)
+    # of two items waiting with the same block and key only the newer one, which is checked first, keeps its stack
+    def __schedule(self:SubProgram, check: List[list], pending: Dict[tuple,list], index: int, stack: List[int]) -> None:
+        block = self.blocks.get(index)
+        if block is None or block.btype != BlockType.CODE:
+            check.append([index, None, None])
+            return
+        key = block.stack_key(stack)
+        if block.would_stop(key):
+            check.append([index, None, key])
+            return
+        older = pending.get((index, key))
+        if older is not None:
+            older[1] = None
+        item = [index, stack, key]
+        pending[(index, key)] = item
+        check.append(item)
 
-        check = [] # holds list of index-stack pairs that have to be checked, (index of codeblock, stack to test that block on)
+    def __execute(self:SubProgram, start: int = 0, stack:List[int] = None) -> None:
+
+        if stack is None:
+            stack = []
+        check = []      # items that have to be checked, see __schedule
+        pending = {}    # (index, key) -> item holding a stack
 
         if not start in self.blocks and self.blocks[start].btype != BlockType.CODE:
             return 
         
-        ret = []
-        try:
-            ret = self.blocks[start].execute(stack,self.jump_dests)
-        except Exception as e:
-            pass
+        stats = self.stats
+        if not self.budget.take():
+            return
+        status, ret = self.blocks[start].execute(stack,self.jump_dests)
+        if stats is not None:
+            stats.count('block_executions')
+            stats.count('status_' + status.value)
 
-        for i in ret:
-            check += [(i,stack.copy())]
+        # the stack is only copied for all but the last successor
+        for k in range(len(ret)):
+            self.__schedule(check, pending, ret[k], stack if k == len(ret) - 1 else stack.copy())
 
         check_count = 0
 
         while(check!=[] and check_count != GLOBALS.MAX_TOTAL_BLOCK_EXECUTION_SIZE):
             check_count += 1
-            current = check.pop()
-            if not current[0] in self.blocks or self.blocks[current[0]].btype != BlockType.CODE:    
-                #ignore if no block exists/ block is not code, can happen for jumpi that act as normal jump
+            index, stack, key = check.pop()
+            if stack is None:
+                block = self.blocks.get(index)
+                if block is not None and block.btype == BlockType.CODE:
+                    if stats is not None and block.known_stack is not None and key in block.known_stack:
+                        stats.count('known_stack_hits')
+                    block.skip()
                 continue
-            try:
-                ret = self.blocks[current[0]].execute(current[1],self.jump_dests)
-                for i in ret:
-                    check.append((i,current[1].copy()))
-            except Exception as e:
-                pass
-
-    def __init__(self, code:bytes, size: Tuple[int,int,BlockType], meta:List[Tuple[int,int]]):
-        self.code = code
+            del pending[(index, key)]
+            if not self.budget.take():
+                return
+            status, ret = self.blocks[index].execute(stack,self.jump_dests,key)
+            if stats is not None:
+                stats.count('block_executions')
+                stats.count('status_' + status.value)
+            for k in range(len(ret)):
+                self.__schedule(check, pending, ret[k], stack if k == len(ret) - 1 else stack.copy())
+
+    def __init__(self, disassembly: Disassembly, size: Tuple[int,int,BlockType], meta:List[Tuple[int,int]], budget: Budget = None, stats: Stats = None):
+        """
+        disassembly is the window of the whole code this subprogram starts at, see Disassembly::window
+        budget limits the executions, it is usually shared with the other subprograms of the code
+        stats collects phase times and counters if given
+        """
+        self.disassembly = disassembly
+        self.code = disassembly.code
         self.base = size[0]
         self.meta = meta
         self.predicted_end = size[1]
         self.blocks: {int,Block} = {}
-        self.jump_dests: [int] = self.__create_jump_dests()
-        self.__create_blocks()    
\ No newline at end of file
+        self.jump_dests = JumpDests(disassembly)
+        self.budget = budget if budget is not None else Budget()
+        self.stats = stats
+        with phase(self.stats, 'create_blocks'):
+            self.__create_blocks()
+            self.__link_blocks()
+        if self.stats is not None:
+            self.stats.count('blocks_created', len(self.blocks))    
\ No newline at end of file
@@ -0,0 +1,137 @@
+"""
+generator of synthetic bytecode for benchmarks, every contract is a deterministic function of its seed
+
+the shapes follow what compilers emit: a function dispatcher, function bodies with loops, constructors that copy
+the runtime code, factories with embedded child contracts, data blobs and cbor metadata, plus random instruction soup
+"""
+
+from __future__ import annotations
+
+import random
+from typing import List, Tuple
+
+OPS = {'STOP':0x00,'ADD':0x01,'SUB':0x03,'LT':0x10,'GT':0x11,'EQ':0x14,'ISZERO':0x15,'AND':0x16,'SHR':0x1c,
+       'CALLVALUE':0x34,'CALLDATALOAD':0x35,'CALLDATASIZE':0x36,'CODECOPY':0x39,'POP':0x50,'MLOAD':0x51,'MSTORE':0x52,
+       'SLOAD':0x54,'SSTORE':0x55,'JUMP':0x56,'JUMPI':0x57,'JUMPDEST':0x5b,'DUP1':0x80,'DUP2':0x81,'SWAP1':0x90,
+       'RETURN':0xf3,'REVERT':0xfd,'INVALID':0xfe}
+
+"""opcodes used by the instruction soup"""
+SOUP_OPS: bytes = bytes([0x00,0x01,0x02,0x03,0x04,0x06,0x08,0x0a,0x10,0x11,0x14,0x15,0x16,0x19,0x1c,0x34,0x35,0x36,0x39,0x3b,
+                         0x50,0x51,0x52,0x54,0x55,0x56,0x57,0x5b,0x80,0x81,0x82,0x83,0x90,0x91,0x92,0xf3,0xfd,0xfe])
+
+"""names of the generated kinds, see contract"""
+KINDS: Tuple[str] = ('runtime', 'initcode', 'factory', 'blob', 'soup')
+
+# assembler items: (name,) for an opcode, ('label', name) for a JUMPDEST, ('ref', name) for a PUSH2 of a label, ('raw', bytes)
+
+def push(value: int, size: int = None) -> List[tuple]:
+    if size is None:
+        size = max(1, (value.bit_length() + 7) // 8)
+    return [('raw', bytes([0x5f + size]) + value.to_bytes(size, 'big'))]
+
+def op(*names: str) -> List[tuple]:
+    return [(n,) for n in names]
+
+def assemble(items: List[tuple]) -> bytes:
+    labels = {}
+    code = b''
+    # labels only refer to PUSH2, so the second pass sees the final positions
+    for _ in range(2):
+        code = b''
+        found = {}
+        for it in items:
+            if it[0] == 'label':
+                found[it[1]] = len(code)
+                code += bytes([OPS['JUMPDEST']])
+            elif it[0] == 'ref':
+                code += b'\x61' + labels.get(it[1], 0).to_bytes(2, 'big')
+            elif it[0] == 'raw':
+                code += it[1]
+            else:
+                code += bytes([OPS[it[0]]])
+        labels = found
+    return code
+
+def cbor_metadata(rng: random.Random) -> bytes:
+    """solc style metadata: a cbor map with an ipfs hash and the compiler version followed by its length"""
+    body = b'\xa2\x64ipfs\x58\x22' + rng.randbytes(34) + b'\x64solc\x43\x00\x08\x07'
+    return body + len(body).to_bytes(2, 'big')
+
+def runtime(rng: random.Random, functions: int = 4, loops: bool = True, blob: int = 0, metadata: bool = True) -> bytes:
+    """dispatcher over the given number of functions, every second function body contains a loop"""
+    it = push(0x80) + push(0x40) + op('MSTORE') + push(4) + op('CALLDATASIZE', 'LT') + [('ref', 'fallback')] + op('JUMPI')
+    it += push(0) + op('CALLDATALOAD') + push(0xe0) + op('SHR')
+    for i in range(functions):
+        it += op('DUP1') + push(rng.getrandbits(32), 4) + op('EQ') + [('ref', f'fn{i}')] + op('JUMPI')
+    it += [('label', 'fallback')] + push(0) + op('DUP1', 'REVERT')
+    for i in range(functions):
+        it += [('label', f'fn{i}')] + op('CALLVALUE', 'DUP1', 'ISZERO') + [('ref', f'ok{i}')] + op('JUMPI') + push(0) + op('DUP1', 'REVERT')
+        it += [('label', f'ok{i}')] + op('POP') + [('ref', f'ret{i}')] + [('ref', f'body{i}')] + op('JUMP')
+        it += [('label', f'ret{i}')] + op('STOP')
+    for i in range(functions):
+        it += [('label', f'body{i}')]
+        if loops and i % 2 == 0:
+            it += push(0) + [('label', f'loop{i}')] + op('DUP1') + push(rng.randint(2, 6)) + op('SWAP1', 'LT', 'ISZERO') + [('ref', f'end{i}')] + op('JUMPI')
+            it += push(rng.getrandbits(8)) + op('SLOAD', 'POP') + push(1) + op('ADD') + [('ref', f'loop{i}')] + op('JUMP')
+            it += [('label', f'end{i}')] + op('POP')
+        else:
+            it += push(rng.getrandbits(16)) + op('DUP1', 'SSTORE', 'POP')
+        it += op('JUMP')
+    it += op('INVALID')
+    code = assemble(it)
+    code += rng.randbytes(blob)
+    if metadata:
+        code += cbor_metadata(rng)
+    return code
+
+def initcode(runtime_code: bytes) -> bytes:
+    """constructor that returns the given runtime code, which follows right behind it"""
+    def items(offset: int) -> List[tuple]:
+        it = push(0x80) + push(0x40) + op('MSTORE', 'CALLVALUE', 'DUP1', 'ISZERO') + [('ref', 'deploy')] + op('JUMPI') + push(0) + op('DUP1', 'REVERT')
+        it += [('label', 'deploy')] + op('POP') + push(len(runtime_code), 2) + op('DUP1') + push(offset, 2) + push(0) + op('CODECOPY') + push(0) + op('RETURN', 'INVALID')
+        return it
+    return assemble(items(len(assemble(items(0))))) + runtime_code
+
+def soup(rng: random.Random, size: int) -> bytes:
+    """random instructions with jumps to random JUMPDESTs, data islands and optional metadata"""
+    code = bytearray()
+    dests = []
+    while len(code) < size:
+        r = rng.random()
+        if r < 0.08:
+            dests.append(len(code))
+            code.append(OPS['JUMPDEST'])
+        elif r < 0.2:
+            target = rng.choice(dests) if dests and rng.random() < 0.8 else rng.randint(0, size)
+            code += b'\x61' + target.to_bytes(2, 'big') + bytes([rng.choice((OPS['JUMP'], OPS['JUMPI'], OPS['JUMPI']))])
+        elif r < 0.35:
+            n = rng.randint(1, 4)
+            code += bytes([0x5f + n]) + rng.randbytes(n)
+        elif r < 0.37:
+            code += rng.randbytes(rng.randint(1, 40))
+        else:
+            code.append(rng.choice(SOUP_OPS))
+    if rng.random() < 0.3:
+        code += cbor_metadata(rng)
+    return bytes(code)
+
+def contract(seed: int, kind: str = None) -> bytes:
+    """contract of the given kind, or of a kind chosen by the seed"""
+    rng = random.Random(seed)
+    if kind is None:
+        kind = KINDS[seed % len(KINDS)]
+    if kind == 'runtime':
+        return runtime(rng, rng.randint(1, 8))
+    if kind == 'initcode':
+        return initcode(runtime(rng, rng.randint(1, 6)))
+    if kind == 'factory':
+        child = initcode(runtime(rng, rng.randint(1, 3)))
+        return runtime(rng, rng.randint(1, 4), blob = rng.randint(0, 200)) + child
+    if kind == 'blob':
+        return runtime(rng, rng.randint(1, 5), blob = rng.randint(100, 20000), metadata = rng.random() < 0.5)
+    if kind == 'soup':
+        return soup(rng, rng.randint(20, 1500))
+    raise ValueError(f"unknown kind {kind}")
+
+def corpus(n: int, seed: int = 0, kind: str = None) -> List[bytes]:
+    return [contract(seed + i, kind) for i in range(n)]
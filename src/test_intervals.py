@@ -0,0 +1,78 @@
+"""
+boundaries of the interval structures blocks_at and blocks_in rely on, run with python -m unittest test_intervals from src
+"""
+
+import unittest
+from intervals import IntervalIndex, IntervalSet
+
+class IntervalSetTest(unittest.TestCase):
+
+    def test_point_lookups(self):
+        s = IntervalSet()
+        s.update([(10, 20)])
+        self.assertNotIn(9, s)
+        self.assertIn(10, s)
+        self.assertIn(19, s)
+        self.assertNotIn(20, s)
+
+    def test_adjacent_intervals_are_merged(self):
+        s = IntervalSet()
+        s.update([(0, 5), (5, 8)])
+        self.assertEqual((s.starts, s.ends), ([0], [8]))
+        self.assertIn(4, s)
+        self.assertIn(5, s)
+        self.assertNotIn(8, s)
+
+    def test_unsorted_update(self):
+        s = IntervalSet()
+        s.update([(30, 40), (0, 10), (35, 50), (5, 12), (20, 20)])
+        self.assertEqual((s.starts, s.ends), ([0, 30], [12, 50]))
+        s.update([(12, 15), (60, 70), (25, 31)])
+        self.assertEqual((s.starts, s.ends), ([0, 25, 60], [15, 50, 70]))
+        self.assertEqual([p for p in range(75) if p in s], list(range(0, 15)) + list(range(25, 50)) + list(range(60, 70)))
+
+    def test_empty(self):
+        s = IntervalSet()
+        self.assertNotIn(0, s)
+        s.update([(3, 3), (5, 4)])
+        self.assertEqual(len(s), 0)
+
+class IntervalIndexTest(unittest.TestCase):
+
+    def test_point_lookups(self):
+        index = IntervalIndex([(10, 20, 'a')])
+        self.assertEqual(index.at(9), [])
+        self.assertEqual(index.at(10), ['a'])
+        self.assertEqual(index.at(19), ['a'])
+        self.assertEqual(index.at(20), [])
+
+    def test_adjacent_intervals(self):
+        index = IntervalIndex([(5, 8, 'b'), (0, 5, 'a')])
+        self.assertEqual(index.at(4), ['a'])
+        self.assertEqual(index.at(5), ['b'])
+        self.assertEqual(index.overlapping(4, 6), ['a', 'b'])
+        self.assertEqual(index.overlapping(5, 6), ['b'])
+        self.assertEqual(index.overlapping(0, 5), ['a'])
+
+    def test_range_overlaps(self):
+        index = IntervalIndex([(20, 30, 'c'), (0, 100, 'outer'), (10, 20, 'b'), (40, 41, 'd'), (7, 7, 'empty')])
+        self.assertEqual(len(index), 4)
+        self.assertEqual(index.overlapping(0, 100), ['outer', 'b', 'c', 'd'])
+        self.assertEqual(index.overlapping(19, 21), ['outer', 'b', 'c'])
+        self.assertEqual(index.overlapping(30, 40), ['outer'])
+        self.assertEqual(index.overlapping(35, 35), [])
+        self.assertEqual(index.overlapping(100, 200), [])
+        # the long interval reaches over the short ones before the query
+        self.assertEqual(index.at(50), ['outer'])
+        self.assertEqual(index.at(40), ['outer', 'd'])
+
+    def test_against_brute_force(self):
+        intervals = [(s, s + l, i) for i, (s, l) in enumerate([(3, 4), (0, 2), (8, 1), (2, 9), (6, 0), (11, 3), (5, 2), (5, 2)])]
+        index = IntervalIndex(intervals)
+        ordered = sorted((x for x in intervals if x[0] < x[1]), key = lambda x: (x[0], x[1]))
+        for start in range(16):
+            for end in range(start, 17):
+                self.assertEqual(index.overlapping(start, end), [x[2] for x in ordered if x[0] < end and x[1] > start and start < end])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+"""
+round trips of the result formats through the writers and readers of records.py, run with python -m unittest test_records from src
+"""
+
+import io
+import json
+import unittest
+import records
+from block import BlockType
+
+RESULTS = [
+    ('0xabc', 77, [(0, 40, BlockType.CODE, 0), (41, 60, BlockType.DATA, None), (61, 76, BlockType.META, None)], False),
+    ('contract-é', 5, [(0, 4, BlockType.CODE, 2**32 - 2)], True),
+    ('', 0, [], False),
+]
+
+class RoundTrip(unittest.TestCase):
+
+    def test_binary(self):
+        fp = io.BytesIO()
+        self.assertEqual(list(records.write_results(fp, 'binary', RESULTS)), RESULTS)
+        fp.seek(0)
+        self.assertEqual(list(records.read_binary(fp)), RESULTS)
+
+    def test_jsonl(self):
+        fp = io.StringIO()
+        self.assertEqual(list(records.write_results(fp, 'jsonl', RESULTS)), RESULTS)
+        lines = fp.getvalue().splitlines()
+        self.assertEqual(len(lines), len(RESULTS))
+        for line, r in zip(lines, RESULTS):
+            obj = json.loads(line)
+            blocks = [(b[0], b[1], BlockType(b[2]), b[3]) for b in obj['blocks']]
+            self.assertEqual((obj['codeid'], obj['length'], blocks, obj.get('truncated', False)), r)
+
+    def test_every_type_has_a_code(self):
+        self.assertEqual(set(records.TYPE_CODES), set(BlockType))
+        self.assertEqual(records.unpack_blocks(records.pack_blocks(RESULTS[0][2])), RESULTS[0][2])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+"""
+inputs whose segmentation changed by accident once, run with python -m unittest test_regressions from src
+"""
+
+import contextlib
+import io
+import unittest
+import synthetic
+from block import BlockType
+from budget import Budget
+from etherseg import EtherSeg
+from subcache import SubcodeCache
+
+def segment(code: str):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return EtherSeg(bytes.fromhex(code)).get_blocks()
+
+class HandlerErrors(unittest.TestCase):
+    """values a handler cannot compute with, like the negative ones SUB leaves, neither raise nor end the subprogram"""
+
+    def test_negative_exponent(self):
+        # EXP of 0 ** -2 would divide by zero, it gives an unknown value
+        self.assertEqual(segment('6080604052600560030360000a50600c565b005b600160005500'), [(0, 25, BlockType.CODE, 0)])
+
+    def test_float_jump_target(self):
+        # EXP of 2 ** -1 would give the jump target 0.5, it gives an unknown value
+        self.assertEqual(segment('6080604052600160000360020a565b00'), [(0, 15, BlockType.CODE, 0)])
+
+class SubcodeBudget(unittest.TestCase):
+    """a subcode cache hit uses up the steps of the subprogram, a step budget gives the same result warm as fresh"""
+
+    def test_warm_cache_with_step_budget(self):
+        code = synthetic.contract(0, 'factory')
+        subcache = SubcodeCache()
+        with contextlib.redirect_stdout(io.StringIO()):
+            EtherSeg(code, subcache = subcache).get_blocks()
+            for steps in (1, 5, 50):
+                fresh = EtherSeg(code, Budget(steps = steps))
+                warm = EtherSeg(code, Budget(steps = steps), subcache = subcache)
+                self.assertEqual(warm.get_blocks(), fresh.get_blocks())
+                self.assertEqual(warm.truncated, fresh.truncated)
+        self.assertGreater(subcache.hits, 0)
+
+if __name__ == '__main__':
+    unittest.main()
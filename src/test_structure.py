@@ -0,0 +1,75 @@
+"""
+cborLength decides where metadata ends, it is compared against cbor2 here, run with python -m unittest test_structure from src
+"""
+
+import io
+import unittest
+import cbor2
+from structure import cborLength
+
+def cbor2_length(data: bytes) -> int:
+    fp = io.BytesIO(data)
+    cbor2.CBORDecoder(fp).decode()
+    return fp.tell()
+
+DEFINITE = [cbor2.dumps(x) for x in [
+    0, 23, 24, 255, 256, 65535, 65536, 2**32 - 1, 2**32, 2**64 - 1, -1, -24, -25, -500,
+    b'', b'\x01' * 23, b'\x02' * 24, b'\x03' * 300, '', 'solc', 'x' * 70000,
+    [], [1, [2, [3, []]], {}], list(range(30)), {'a': 1, 'b': [True, False, None]},
+    {'ipfs': bytes(34), 'solc': b'\x00\x08\x11'}, {'bzzr0': bytes(32), 'experimental': True},
+    cbor2.CBORTag(42, b'\x00\x01'), cbor2.CBORTag(1000, [cbor2.CBORTag(2, b'\x01')]),
+    1.5, 1e300, True, None,
+]] + [
+    bytes.fromhex('f93e00'),    # half precision float
+    bytes.fromhex('fa47c35000'),  # single precision float
+]
+
+INDEFINITE = [bytes.fromhex(x) for x in [
+    '9fff',                     # empty array
+    '9f0102ff',                 # array
+    '9f01820203ff',             # array with a definite one
+    '9f019f02ffff',             # nested
+    '8301819f0203ff04',         # indefinite inside definite
+    'bf61619f02ff616201ff',     # map
+    'bfff',                     # empty map
+    '5f42010243030405ff',       # byte string in chunks
+    '7f6261626163ff',           # text string in chunks
+]] + [bytes.fromhex('bf64736f6c63') + cbor2.dumps(b'\x00' * 3) + b'\xff']
+
+class CborLength(unittest.TestCase):
+
+    def assertLength(self, item: bytes, prefix: bytes = b'\x60\x80', suffix: bytes = b'\x00\x33'):
+        code = prefix + item + suffix
+        self.assertEqual(cborLength(code, len(prefix), len(code)), cbor2_length(item), item.hex())
+
+    def test_definite(self):
+        for item in DEFINITE:
+            self.assertLength(item)
+
+    def test_indefinite(self):
+        for item in INDEFINITE:
+            self.assertLength(item)
+
+    def test_end_of_item(self):
+        # the item may end exactly at end, but not behind it
+        for item in DEFINITE + INDEFINITE:
+            self.assertEqual(cborLength(item, 0, len(item)), len(item), item.hex())
+            if len(item) > 1:
+                self.assertIsNone(cborLength(item + b'\x00', 0, len(item) - 1), item.hex())
+
+    def test_truncated(self):
+        # every prefix of an item is rejected by cbor2 and has no length
+        for item in DEFINITE + INDEFINITE:
+            # cbor2 is slow on the prefixes of long items, their last ones are enough
+            for cut in range(max(len(item) - 64, 0) if len(item) > 300 else 0, len(item)):
+                with self.assertRaises(cbor2.CBORDecodeError):
+                    cbor2_length(item[:cut])
+                self.assertIsNone(cborLength(item[:cut], 0, cut), item[:cut].hex())
+
+    def test_invalid_headers(self):
+        # reserved additional information and a break outside of an indefinite item
+        for item in ['1c', '3d', '5e', 'ff', '1f', 'df01', '9f1cff']:
+            self.assertIsNone(cborLength(bytes.fromhex(item), 0, len(item) // 2), item)
+
+if __name__ == '__main__':
+    unittest.main()